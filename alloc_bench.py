@@ -0,0 +1,62 @@
+import tracemalloc
+
+from common import rule
+from traffic_env import Car, Game, Pedestrian
+
+__author__ = "leon.ljsh"
+
+
+def constructed(kinds):
+    # counts the entities built from scratch, recycled ones keep their object
+    counts = {kind: 0 for kind in kinds}
+    for kind in kinds:
+        init = kind.__init__
+
+        def counting(self, *args, kind=kind, init=init):
+            counts[kind] += 1
+            init(self, *args)
+        kind.__init__ = counting
+    return counts
+
+
+def episode(game):
+    # the peak within a tick needs tracemalloc.reset_peak of python 3.9, older versions only run the episode
+    peaks = hasattr(tracemalloc, "reset_peak")
+    transient = 0
+    ticks = 0
+    while not game.go:
+        game.set(rule(game.get()))
+        if peaks:
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        game.tick(1 / 15)
+        if peaks:
+            transient += tracemalloc.get_traced_memory()[1] - before
+        ticks += 1
+    return transient / ticks if peaks else None
+
+
+def main():
+    counts = constructed((Car, Pedestrian))
+    tracemalloc.start()
+
+    game = Game(1200, gui=False, seed=0)
+    start = tracemalloc.get_traced_memory()[0]
+    entities = [Car((0, 0), True, game.traffic_light, game) for _ in range(10000)]
+    print("bytes per car: {:.0f}".format((tracemalloc.get_traced_memory()[0] - start) / len(entities)))
+    del entities
+
+    for number in range(3):
+        counts[Car] = counts[Pedestrian] = 0
+        game.restart(number)
+        start = tracemalloc.get_traced_memory()[0]
+        transient = episode(game)
+        crossed = game.cars_crossed + game.peds_crossed
+        print("episode {}: {} entities crossed, {} constructed, {} bytes peak per tick, {:+.0f} bytes kept".format(
+            number, crossed, counts[Car] + counts[Pedestrian], "n/a" if transient is None else round(transient),
+            tracemalloc.get_traced_memory()[0] - start))
+    tracemalloc.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from common import PHASES, above_zero, rule
+from main import run
+from traffic_env import Car, Game, Pedestrian, TrafficState
+from transport import LoopbackTransport
+
+__author__ = "leon.ljsh"
+
+
+def phase_game(max_time, possibilities):
+    game = Game(max_time, gui=False, seed=0)
+    game.gen_possibilities = [possibilities] * 4
+    return game
+
+
+def hold_game(max_time, size, red):
+    # a queue of `size` entities waiting at the stop lines of a light held against them, held short of failing
+    game = Game(max_time, gui=False, seed=0)
+    game.traffic_light.state = TrafficState.red if red else TrafficState.green
+    game.traffic_light.control_sig = not red
+    for i in range(size // 2):
+        if red:
+            game.spawn(game.car_lanes, game.entity(Car, (-5 - 5 * i, 4.5), True))
+            game.spawn(game.car_lanes, game.entity(Car, (game.zebra_width + 1 + 5 * i, 1.5), False))
+        else:
+            game.spawn(game.pedestrian_lanes, game.entity(Pedestrian, (1, -0.8 - 0.8 * i), True))
+            game.spawn(game.pedestrian_lanes, game.entity(Pedestrian, (2, game.road_width + 0.3 + 0.8 * i), False))
+    return game
+
+
+def scenarios(max_time):
+    for number, possibilities in enumerate(PHASES):
+        yield "phase {} {:.3f}/{:.3f}".format(number, *possibilities), \
+            lambda possibilities=possibilities: phase_game(max_time, possibilities), None
+    yield "heavy 1/1", lambda: phase_game(max_time, (1, 1)), None
+    for size in (10, 100, 1000):
+        # cars fail after 120s and pedestrians after 90s of waiting
+        yield "red hold {}".format(size), lambda size=size: hold_game(60, size, True), [False]
+        yield "green hold {}".format(size), lambda size=size: hold_game(60, size, False), [True]
+
+
+def drive(game, inputs):
+    latencies = []
+    while not game.go:
+        game.set(inputs or rule(game.get()))
+        start = time.perf_counter()
+        game.tick(1 / 15)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def measure(make, inputs):
+    game = make()
+    start = time.perf_counter()
+    latencies = drive(game, inputs)
+    elapsed = time.perf_counter() - start
+
+    # a second run under tracemalloc, which would distort the timings
+    game = make()
+    tracemalloc.start()
+    drive(game, inputs)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    latencies.sort()
+    return {"ticks": len(latencies), "ticks_per_s": len(latencies) / elapsed,
+            "p50_us": percentile(latencies, 0.5) * 1e6, "p90_us": percentile(latencies, 0.9) * 1e6,
+            "p99_us": percentile(latencies, 0.99) * 1e6, "max_us": latencies[-1] * 1e6, "peak_bytes": peak,
+            "entities": len(game.car_lanes[True]) + len(game.car_lanes[False]) +
+                        len(game.pedestrian_lanes[True]) + len(game.pedestrian_lanes[False])}
+
+
+def end_to_end(max_time, episodes):
+    games = [Game(max_time, gui=False, seed=0)]
+    start = time.perf_counter()
+    run([LoopbackTransport(episodes)], games, verbose=False)
+    served = episodes / (time.perf_counter() - start)
+
+    game = Game(max_time, gui=False, seed=0)
+    start = time.perf_counter()
+    for _ in range(episodes):
+        drive(game, None)
+        game.restart()
+    direct = episodes / (time.perf_counter() - start)
+    return {"episodes": episodes, "served_per_s": served, "direct_per_s": direct}
+
+
+def startup(runs):
+    # a fresh headless worker up to its first tick, against an interpreter that does nothing
+    code = ("import sys\nfrom traffic_env import Game\ngame = Game(60, gui=False)\ngame.tick(1 / 15)\n"
+            "print('pygame' in sys.modules)")
+    # the modules are imported from the directory of this file whatever the current one
+    here = os.path.dirname(os.path.abspath(__file__))
+    spent = {}
+    for name, argv in (("bare", ["-c", "pass"]), ("first_tick", ["-c", code])):
+        spent[name] = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            output = subprocess.check_output([sys.executable] + argv, cwd=here)
+            spent[name].append(time.perf_counter() - start)
+        spent[name].sort()
+    report = subprocess.run([sys.executable, "-X", "importtime", "-c", "import traffic_env"], cwd=here,
+                            stderr=subprocess.PIPE, universal_newlines=True).stderr
+    # the last line is traffic_env itself, its cumulative time includes everything it imports
+    imported = int(report.strip().splitlines()[-1].split("|")[1])
+    return {"runs": runs, "bare_ms": percentile(spent["bare"], 0.5) * 1e3,
+            "first_tick_ms": percentile(spent["first_tick"], 0.5) * 1e3, "import_us": imported,
+            "pygame_loaded": output.strip() == b"True"}
+
+
+def frame_time(frames):
+    if importlib.util.find_spec("pygame") is None:
+        return None
+    # no window is needed to time the drawing
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    game = Game(3600, gui=True, seed=0)
+    spent = []
+    for _ in range(frames):
+        game.set(rule(game.get()))
+        game.tick(1 / 15)
+        game.tick(1 / 15)
+        start = time.perf_counter()
+        game.draw()
+        spent.append(time.perf_counter() - start)
+    spent.sort()
+    return {"frames": frames, "mean_us": sum(spent) / frames * 1e6, "p50_us": percentile(spent, 0.5) * 1e6,
+            "p99_us": percentile(spent, 0.99) * 1e6}
+
+
+def commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark the traffic environment headless")
+    parser.add_argument("-t", "--time", help="simulation time of the traffic phase runs in seconds "
+                                             "(default: %(default)s)",
+                        metavar="sec", type=above_zero, dest="time", default=600)
+    parser.add_argument("-e", "--episodes", help="episodes of the end-to-end run through main.serve "
+                                                 "(default: %(default)s)",
+                        metavar="n", type=above_zero, dest="episodes", default=3)
+    parser.add_argument("-o", "--output", help="json file for the results (default: %(default)s)",
+                        metavar="file", type=str, dest="output", default="bench.json")
+    args = parser.parse_args()
+
+    results = {"commit": commit(), "python": platform.python_version(), "time": args.time, "scenarios": {}}
+    print("{:24} {:>7} {:>9} {:>8} {:>8} {:>8} {:>10} {:>8}".format(
+        "scenario", "ticks", "ticks/s", "p50 us", "p90 us", "p99 us", "peak KiB", "entities"))
+    for name, make, inputs in scenarios(args.time):
+        result = measure(make, inputs)
+        results["scenarios"][name] = result
+        print("{:24} {ticks:7} {ticks_per_s:9.0f} {p50_us:8.1f} {p90_us:8.1f} {p99_us:8.1f} {:10.1f} "
+              "{entities:8}".format(name, result["peak_bytes"] / 1024, **result))
+
+    result = startup(10)
+    results["startup"] = result
+    print("startup: {first_tick_ms:.0f}ms to the first headless tick, {bare_ms:.0f}ms bare interpreter, "
+          "{import_us}us importing traffic_env, pygame loaded: {pygame_loaded}".format(**result))
+
+    result = frame_time(2000)
+    results["draw"] = result
+    if result is None:
+        print("draw: pygame is not installed, skipped")
+    else:
+        print("draw: {mean_us:.0f}us mean, {p50_us:.0f}us p50, {p99_us:.0f}us p99 per frame".format(**result))
+
+    result = end_to_end(args.time, args.episodes)
+    results["end_to_end"] = result
+    print("end to end: {served_per_s:.2f} episodes/s through main.serve, {direct_per_s:.2f} episodes/s "
+          "direct".format(**result))
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print("written to {}".format(args.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import functools
+import hashlib
+import inspect
+import json
+import os
+import tempfile
+
+import common
+import pool
+import traffic_env
+
+__author__ = "leon.ljsh"
+
+# results of another version of the simulation, of the way a worker plays it or of the stock controllers are never
+# reused
+ENGINE = hashlib.sha256("".join(inspect.getsource(module) for module in (traffic_env, pool, common))
+                        .encode()).hexdigest()
+PLAIN = (bool, int, float, str, type(None))
+
+
+def value(obj):
+    # a default or a captured variable of a controller, None if it can not be written down
+    if isinstance(obj, PLAIN):
+        return repr(obj)
+    if isinstance(obj, (tuple, list)):
+        items = [value(item) for item in obj]
+        return None if None in items else items
+    if isinstance(obj, dict) and all(isinstance(k, str) for k in obj):
+        items = {k: value(v) for k, v in obj.items()}
+        return None if None in items.values() else items
+    return describe(obj)
+
+
+def describe(controller):
+    # what decides the actions of a controller, None if that can not be told from outside
+    if isinstance(controller, functools.partial):
+        parts = {"func": describe(controller.func), "args": value(controller.args),
+                 "keywords": value(controller.keywords)}
+        return None if None in parts.values() else parts
+    if inspect.isfunction(controller):
+        try:
+            source = inspect.getsource(controller)
+        except (OSError, TypeError):
+            return None
+        # lambdas of one line or one closure factory share the source, their values tell them apart
+        parts = {"name": controller.__module__ + "." + controller.__qualname__,
+                 "source": hashlib.sha256(source.encode()).hexdigest(),
+                 "defaults": value(controller.__defaults__ or ()),
+                 "kwdefaults": value(controller.__kwdefaults__ or {})}
+        try:
+            parts["closure"] = value([cell.cell_contents for cell in controller.__closure__ or ()])
+        except ValueError:
+            # a cell that is not filled yet
+            return None
+        return None if None in parts.values() else parts
+    return None
+
+
+class Cache:
+    """Results of finished episodes on disk, one json file per key in `directory`
+
+    A file is written under a temporary name and renamed into place, so a reader in another process sees a whole
+    result or none. Reads touch the file and every `trim_every` writes the least recently used files beyond
+    `max_entries` are removed, a file removed while another process reads it is only a miss.
+    """
+
+    def __init__(self, directory, max_entries=100000, trim_every=256):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_entries = max_entries
+        self.trim_every = trim_every
+        self.writes = 0
+
+    @staticmethod
+    def key(scenario, seed, controller, cutoff=None):
+        # only an episode on a fixed seed is repeatable
+        if seed is None:
+            return None
+        description = describe(controller)
+        if description is None:
+            return None
+        content = json.dumps({"engine": ENGINE, "scenario": scenario, "seed": seed, "controller": description,
+                              "cutoff": cutoff}, sort_keys=True)
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with open(path) as f:
+                result = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return result
+
+    def put(self, key, result):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(descriptor, "w") as f:
+            json.dump(result, f)
+        os.replace(temporary, path)
+        self.writes += 1
+        if self.writes % self.trim_every == 0:
+            self.trim()
+
+    def entries(self):
+        for folder in os.scandir(self.directory):
+            if folder.is_dir():
+                for entry in os.scandir(folder.path):
+                    if entry.name.endswith(".json"):
+                        yield entry
+
+    def trim(self):
+        entries = []
+        for entry in self.entries():
+            try:
+                entries.append((entry.stat().st_mtime, entry.path))
+            except OSError:
+                pass
+        entries.sort()
+        for _, path in entries[:max(0, len(entries) - self.max_entries)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def __len__(self):
+        return sum(1 for _ in self.entries())
@@ -0,0 +1,53 @@
+import copy
+import time
+
+from common import rule
+from traffic_env import Car, Game, Pedestrian
+
+__author__ = "leon.ljsh"
+
+
+def queued_game(size):
+    game = Game(3600, gui=False, seed=0)
+    for i in range(size):
+        game.spawn(game.car_lanes, Car((-6 * i - 4, 4.5), True, game.traffic_light, game))
+        game.spawn(game.car_lanes, Car((game.zebra_width + 6 * i, 1.5), False, game.traffic_light, game))
+        game.spawn(game.pedestrian_lanes, Pedestrian((1, -0.6 * i - 0.5), True, game.traffic_light, game))
+        game.spawn(game.pedestrian_lanes, Pedestrian((2, game.road_width + 0.6 * i), False, game.traffic_light,
+                                                     game))
+    return game
+
+
+def rate(function, duration=0.5):
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        function()
+        count += 1
+    return count / (time.perf_counter() - start)
+
+
+def play(game, ticks):
+    for _ in range(ticks):
+        game.set(rule(game.get()))
+        game.tick(1 / 15)
+    return game.snapshot()
+
+
+def main():
+    game = Game(3600, gui=False, seed=0)
+    play(game, 9000)
+    fork = game.clone()
+    print("clone replays identically: {}".format(play(game, 9000) == play(fork, 9000)))
+
+    print("{:>8} {:>12} {:>12} {:>12} {:>12}".format("entities", "snapshot/s", "restore/s", "clone/s", "deepcopy/s"))
+    for size in (0, 4, 16, 64, 256):
+        game = queued_game(size)
+        state = game.snapshot()
+        print("{:8} {:12.0f} {:12.0f} {:12.0f} {:12.0f}".format(
+            4 * size, rate(game.snapshot), rate(lambda: game.restore(state)), rate(game.clone),
+            rate(lambda: copy.deepcopy(game))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+import argparse
+
+from traffic_env import Game
+
+__author__ = "leon.ljsh"
+
+# cars and pedestrians arriving per second in the four parts of an episode of Game, before the shuffle
+PHASES = [(1 / 14, 1 / 3), (1 / 3, 1 / 20), (1 / 30, 1 / 90), (1 / 3, 1 / 5)]
+
+
+def above_zero(string):
+    value = int(string)
+    if value <= 0:
+        msg = "{} not above zero".format(value)
+        raise argparse.ArgumentTypeError(msg)
+    return value
+
+
+def rule(outputs):
+    return [not (outputs[1] or outputs[2]) or (outputs[3] and outputs[7]) or (outputs[12] and outputs[8])]
+
+
+def phase_share(attach, phase, max_time, episodes):
+    # profiled episodes of the rule controller on a game handed to `attach` first, returns the seconds of `phase` per
+    # call and its share of the other phases of the same ticks, wall time of separate runs is too noisy for a
+    # difference of percents
+    game = Game(max_time, gui=False, seed=0, profile=True)
+    attach(game)
+    for number in range(episodes):
+        game.restart(number)
+        while not game.go:
+            game.set(rule(game.get()))
+            game.tick(1 / 15)
+    phases = game.perf_stats()["phases"]
+    spent = phases[phase]["seconds"]
+    ticking = sum(p["seconds"] for name, p in phases.items() if name not in (phase, "get"))
+    return spent / phases[phase]["calls"], spent / ticking
@@ -0,0 +1,378 @@
+import argparse
+import random
+import time
+from math import e
+
+from common import PHASES, above_zero, rule
+from traffic_env import Car, Game, Lane, Pedestrian, TrafficLight
+
+__author__ = "leon.ljsh"
+
+
+class Segment:
+    """One crossing of a corridor and the road up to the middle of its neighbours, in the coordinates of Game
+
+    Cars and pedestrians take their geometry and their light from the segment they are in, so they run the rules of
+    Game unchanged. The sensors and the failure rule of Game only look at the lanes and the geometry and are shared.
+    """
+
+    __slots__ = ("traffic_light", "car_lanes", "pedestrian_lanes", "road_width", "road_segment", "zebra_width",
+                 "sensors", "cars_crossed", "peds_crossed", "cars_wait", "peds_wait")
+
+    zone_sensor = Game.zone_sensor
+    line_sensors = Game.line_sensors
+    is_fail = Game.is_fail
+
+    def __init__(self):
+        self.road_width = 7
+        self.road_segment = 25
+        self.zebra_width = 3
+        self.sensors = (1, 3, 7, 13, 21)
+        self.restart()
+
+    def restart(self):
+        self.traffic_light = TrafficLight()
+        self.car_lanes = {True: Lane(), False: Lane()}
+        self.pedestrian_lanes = {True: Lane(), False: Lane()}
+        self.cars_crossed = 0
+        self.peds_crossed = 0
+        self.cars_wait = 0
+        self.peds_wait = 0
+
+    def get(self):
+        outputs = [(1, 1, 0, 0)[self.traffic_light.state.value],
+                   self.zone_sensor(-self.zebra_width, 0),
+                   self.zone_sensor(self.road_width, self.road_width + self.zebra_width)]
+        outputs.extend(self.line_sensors(True, [-s for s in self.sensors]))
+        outputs.extend(self.line_sensors(False, [s + self.zebra_width for s in self.sensors]))
+        return [int(out) for out in outputs]
+
+
+class Rear:
+    """Last car of the next segment as seen from the one behind it"""
+
+    __slots__ = ("pos", "w")
+
+    def __init__(self, car, shift):
+        self.pos = (car.pos[0] + shift, car.pos[1])
+        self.w = car.w
+
+
+class Corridor:
+    """Crossings in a row, cars enter at both ends and pass every light on their way, pedestrians cross at each one
+
+    Every segment keeps its own ordered lanes, a car moves to the next segment once it is past the middle of the
+    road between two crossings, so a tick costs the same per crossing and per entity whatever the length. Waiting
+    times are counted per crossing: a car adds its time since the previous crossing and starts again from zero.
+    """
+
+    def __init__(self, crossings, max_time, seed=None, density=1):
+        self.segments = [Segment() for _ in range(crossings)]
+        first = self.segments[0]
+        self.spacing = 2 * first.road_segment + first.zebra_width
+        self.max_time = max_time
+        self.density = density
+        self.free = {Car: [], Pedestrian: []}
+        self.random = random.Random()
+        self.seed(seed)
+        self.restart()
+
+    def seed(self, seed):
+        self.random.seed(seed)
+        self.gen_possibilities = list(PHASES)
+        self.random.shuffle(self.gen_possibilities)
+
+    def restart(self, seed=None):
+        if seed is not None:
+            self.seed(seed)
+        for segment in self.segments:
+            for lanes, kind in ((segment.car_lanes, Car), (segment.pedestrian_lanes, Pedestrian)):
+                for lane in lanes.values():
+                    self.free[kind].extend(lane)
+            segment.restart()
+        self.sim_time = 0
+        self.ticks = 0
+        self.go = False
+        self.fitness = 0
+
+    @property
+    def current_part(self):
+        return min(3, int(self.sim_time * 4 / self.max_time))
+
+    def entity(self, kind, pos, direction, segment):
+        free = self.free[kind]
+        if not free:
+            return kind(pos, direction, segment.traffic_light, segment)
+        entity = free.pop()
+        entity.reset(pos, direction, segment.traffic_light)
+        entity.game = segment
+        return entity
+
+    def get(self):
+        return [segment.get() for segment in self.segments]
+
+    def set(self, inputs):
+        for segment, signal in zip(self.segments, inputs):
+            segment.traffic_light.control_sig = signal[0] > 0.5
+
+    def tick(self, dt):
+        if self.go:
+            return
+        segments = self.segments
+        for segment in segments:
+            segment.traffic_light.tick(dt)
+        # downstream segments first, every car follows a leader that has already moved, across segments as well
+        rear = None
+        for segment in reversed(segments):
+            lane = segment.car_lanes[True]
+            leader = rear and Rear(rear, self.spacing)
+            for car in lane:
+                car.tick(dt, leader)
+                leader = car
+            rear = lane.rear if lane else None
+        rear = None
+        for segment in segments:
+            lane = segment.car_lanes[False]
+            leader = rear and Rear(rear, -self.spacing)
+            for car in lane:
+                car.tick(dt, leader)
+                leader = car
+            rear = lane.rear if lane else None
+        for segment in segments:
+            Game.tick_lanes(segment.pedestrian_lanes, dt)
+
+        self.hand_off()
+        self.spawn(dt)
+        self.update_fitness(dt)
+
+    def hand_off(self):
+        segments = self.segments
+        for i, segment in enumerate(segments):
+            lane = segment.car_lanes[True]
+            while lane and not lane.front.pos[0] < segment.zebra_width + segment.road_segment:
+                self.pass_car(segment, lane.pop_front(), segments[i + 1] if i + 1 < len(segments) else None,
+                              -self.spacing)
+            lane = segment.car_lanes[False]
+            while lane and not lane.front.pos[0] + lane.front.w > -segment.road_segment:
+                self.pass_car(segment, lane.pop_front(), segments[i - 1] if i else None, self.spacing)
+
+            for direction, lane in segment.pedestrian_lanes.items():
+                while lane and not (lane.front.pos[1] < segment.road_width + 2 * segment.zebra_width if direction
+                                    else lane.front.pos[1] + lane.front.l > -2 * segment.zebra_width):
+                    p = lane.pop_front()
+                    segment.peds_crossed += 1
+                    segment.peds_wait += p.cross_time
+                    self.free[Pedestrian].append(p)
+
+    def pass_car(self, segment, car, target, shift):
+        segment.cars_crossed += 1
+        segment.cars_wait += car.cross_time
+        if target is None:
+            self.free[Car].append(car)
+            return
+        car.pos = (car.pos[0] + shift, car.pos[1])
+        car.cross_time = 0
+        car.traffic = target.traffic_light
+        car.game = target
+        target.car_lanes[car.direction].append(car)
+
+    def spawn(self, dt):
+        cars, pedestrians = self.gen_possibilities[self.current_part]
+        cars *= dt * self.density
+        pedestrians *= dt * self.density
+        first, last = self.segments[0], self.segments[-1]
+        if self.random.random() < cars:
+            lane = first.car_lanes[True]
+            left = min(lane.rear.pos[0] - 0.5 - self.random.random() * 5, -first.road_segment) if lane \
+                else -first.road_segment
+            lane.append(self.entity(Car, (left - 4, first.road_width / 2 + (first.road_width / 2 - 2) / 2), True,
+                                    first))
+        if self.random.random() < cars:
+            lane = last.car_lanes[False]
+            right = max(lane.rear.pos[0] + lane.rear.w + 0.5 + self.random.random() * 5,
+                        last.zebra_width + last.road_segment) if lane else last.zebra_width + last.road_segment
+            lane.append(self.entity(Car, (right, (last.road_width / 2 - 2) / 2), False, last))
+
+        for segment in self.segments:
+            if self.random.random() < pedestrians:
+                lane = segment.pedestrian_lanes[True]
+                up = min(lane.rear.pos[1] - 0.1 - self.random.random() * 0.4, -segment.zebra_width * 2) if lane \
+                    else -segment.zebra_width * 2
+                lane.append(self.entity(Pedestrian, (segment.zebra_width / 3, up - 0.5), True, segment))
+            if self.random.random() < pedestrians:
+                lane = segment.pedestrian_lanes[False]
+                edge = 2 * segment.zebra_width + segment.road_width
+                down = max(lane.rear.pos[1] + lane.rear.l + 0.1 + self.random.random() * 0.4, edge) if lane else edge
+                lane.append(self.entity(Pedestrian, (2 * segment.zebra_width / 3, down), False, segment))
+
+    def prefill(self):
+        # cars of the current arrival rate on the road of every segment at their cruising speed of 5 m/s, as they
+        # would be once the first ones reached the far end, instead of simulating them all the way there
+        headway = 5 / (self.gen_possibilities[self.current_part][0] * self.density)
+        for segment in self.segments:
+            start, end = -segment.road_segment, segment.zebra_width + segment.road_segment
+            for direction, y in ((True, segment.road_width / 2 + (segment.road_width / 2 - 2) / 2),
+                                 (False, (segment.road_width / 2 - 2) / 2)):
+                lane = segment.car_lanes[direction]
+                x = start + self.random.random() * headway
+                positions = []
+                while x < end - 4:
+                    positions.append(x)
+                    x += max(5.5, headway * 2 * self.random.random())
+                # the front of a lane is the car furthest along
+                for x in sorted(positions, reverse=direction):
+                    lane.append(self.entity(Car, (x, y), direction, segment))
+
+    def update_fitness(self, dt):
+        self.sim_time += dt
+        self.ticks += 1
+        fail_state = any(segment.is_fail() for segment in self.segments)
+        self.go |= fail_state or self.sim_time > self.max_time
+
+        # the fitness of Game over all crossings, a failure counts everyone still waiting and a tenth of the score
+        cars = sum(s.cars_crossed for s in self.segments)
+        pedestrians = sum(s.peds_crossed for s in self.segments)
+        if not (cars and pedestrians):
+            return
+        crossed = cars + pedestrians
+        wait = sum(s.cars_wait + s.peds_wait for s in self.segments)
+        if fail_state:
+            entities = [entity for s in self.segments for lanes in (s.car_lanes, s.pedestrian_lanes)
+                        for lane in lanes.values() for entity in lane]
+            crossed += len(entities)
+            wait += sum(entity.cross_time for entity in entities)
+        self.fitness = 12216 * e ** (-0.04 * wait / crossed)
+        if fail_state:
+            self.fitness /= 10
+
+    @property
+    def entities(self):
+        return sum(len(lane) for s in self.segments for lanes in (s.car_lanes, s.pedestrian_lanes)
+                   for lane in lanes.values())
+
+
+def step(world):
+    world.set([rule(o) for o in world.get()])
+    world.tick(1 / 15)
+
+
+def warm_up(world, window, limit):
+    # until the mean number of entities over a window stops growing, returns the simulated seconds
+    previous = None
+    for windows in range(1, max(1, limit // window) + 1):
+        entities = 0
+        for _ in range(window):
+            step(world)
+            entities += world.entities
+        if world.go or previous is not None and entities <= previous * 1.02:
+            break
+        previous = entities
+    return windows * window / 15
+
+
+def rate(world, ticks):
+    entities = 0
+    done = 0
+    start = time.perf_counter()
+    while done < ticks and not world.go:
+        step(world)
+        entities += world.entities
+        done += 1
+    return done / (time.perf_counter() - start), entities / max(1, done)
+
+
+class Games:
+    """Independent games, one per crossing, stepped like a corridor for comparison"""
+
+    def __init__(self, crossings, max_time, possibilities, density):
+        self.games = [Game(max_time, gui=False, seed=i) for i in range(crossings)]
+        for game in self.games:
+            game.gen_possibilities = [(possibilities[0] * density, possibilities[1] * density)] * 4
+
+    def get(self):
+        return [game.get() for game in self.games]
+
+    def set(self, inputs):
+        for game, signal in zip(self.games, inputs):
+            game.set(signal)
+
+    def tick(self, dt):
+        for game in self.games:
+            game.tick(dt)
+
+    @property
+    def go(self):
+        return any(game.go for game in self.games)
+
+    @property
+    def entities(self):
+        return sum(len(lane) for game in self.games for lanes in (game.car_lanes, game.pedestrian_lanes)
+                   for lane in lanes.values())
+
+
+def corridor(crossings, possibilities, density):
+    world = Corridor(crossings, 1e9, seed=0, density=density)
+    world.gen_possibilities = [possibilities] * 4
+    world.prefill()
+    return world
+
+
+def games(crossings, possibilities, density):
+    return Games(crossings, 1e9, possibilities, density)
+
+
+def matched(crossings, possibilities, entities, window, limit):
+    # the density of separate games that puts as many entities on a crossing as the corridor has
+    density = 1
+    for _ in range(3):
+        world = games(crossings, possibilities, density)
+        warm_up(world, window, limit)
+        _, measured = rate(world, 2 * window)
+        density *= entities / max(1, measured)
+    world = games(crossings, possibilities, density)
+    warm_up(world, window, limit)
+    return world, density
+
+
+def main():
+    parser = argparse.ArgumentParser(description="scaling of the corridor engine with crossings and traffic density")
+    parser.add_argument("-t", "--ticks", help="timed ticks per run (default: %(default)s)", metavar="n",
+                        type=above_zero, dest="ticks", default=1500)
+    parser.add_argument("-p", "--phase", help="arrival rates of this part of a Game episode for the whole run, "
+                                              "from 0 to 3 (default: %(default)s)",
+                        metavar="n", type=int, choices=range(len(PHASES)), dest="phase", default=3)
+    parser.add_argument("-w", "--warm-up", help="longest warm-up in seconds before the timed ticks, shorter once the "
+                                                "number of entities stops growing (default: %(default)s)",
+                        metavar="sec", type=above_zero, dest="warm_up", default=600)
+    parser.add_argument("-c", "--crossings", help="corridor lengths to run (default: %(default)s)", metavar="n",
+                        type=above_zero, nargs="+", dest="crossings", default=[10, 30, 100])
+    parser.add_argument("-d", "--densities", help="multiples of the arrival rates to run (default: %(default)s)",
+                        metavar="x", type=float, nargs="+", dest="densities", default=[0.5, 0.75, 1])
+    args = parser.parse_args()
+
+    # the corridor is prefilled and warmed up, the separate games run at the density that gives them as many
+    # entities per crossing, so both tick the same load
+    possibilities = PHASES[args.phase]
+    window = 30 * 15
+    print("phase {:.3f}/{:.3f}, entities per crossing and us per entity and tick, separate games on the right".format(
+        *possibilities))
+    print("{:>9} {:>8} {:>8} {:>9} {:>10} {:>11} {:>9} {:>10} {:>11} {:>9} {:>10}".format(
+        "crossings", "density", "warm-up", "ticks/s", "entities", "us/entity", "density", "entities",
+        "us/entity", "ticks/s", "speedup"))
+    for crossings in args.crossings:
+        for density in args.densities:
+            world = corridor(crossings, possibilities, density)
+            warm = warm_up(world, window, args.warm_up * 15)
+            ticks, entities = rate(world, args.ticks)
+            if world.go:
+                print("{:9} {:8} failed after {:.0f}s".format(crossings, density, world.sim_time))
+                continue
+            separate, games_density = matched(crossings, possibilities, entities, window, args.warm_up * 15)
+            games_ticks, games_entities = rate(separate, args.ticks)
+            print("{:9} {:8} {:7.0f}s {:9.1f} {:10.1f} {:11.2f} {:9.2f} {:10.1f} {:11.2f} {:9.1f} {:9.2f}x".format(
+                crossings, density, warm, ticks, entities / crossings, 1e6 / ticks / entities, games_density,
+                games_entities / crossings, 1e6 / games_ticks / games_entities, games_ticks, ticks / games_ticks))
+
+
+if __name__ == "__main__":
+    main()
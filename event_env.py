@@ -0,0 +1,191 @@
+import time
+from math import inf
+
+from traffic_env import Game, TrafficState
+
+__author__ = "leon.ljsh"
+
+
+class EventGame(Game):
+    """Game that jumps over quanta in which nothing can happen.
+
+    Time still advances in quanta of `step` seconds with the rules of Game.tick, but arrivals are drawn ahead as
+    geometric gaps between quanta instead of one Bernoulli trial per quantum. Between two events (an arrival, a
+    light change, an entity starting, stopping or leaving, a traffic phase change, failure or the end of the
+    episode) every entity keeps its velocity, so such quanta are applied in one step.
+    """
+
+    def __init__(self, max_time, gui=True, step=1 / 15, skip_idle=True, seed=None, profile=False):
+        super().__init__(max_time, gui, seed, profile=profile)
+        self.step = step
+        self.skip_idle = skip_idle
+        self.schedule = {}
+        self.schedule_part = None
+
+    def arrival(self, kind, direction, possibility):
+        if self.schedule_part != self.current_part:
+            self.schedule_part = self.current_part
+            self.schedule = {}
+        key = kind, direction
+        if key not in self.schedule:
+            self.schedule[key] = self.ticks - 1 + self.gap(possibility)
+        if self.schedule[key] != self.ticks:
+            return False
+        self.schedule[key] = self.ticks + self.gap(possibility)
+        return True
+
+    def idle_lane(self, lane, direction, axis, length, lo, hi, line, exit_line, blocked, q):
+        # front coordinates along the direction of motion, all lanes move towards larger values
+        quanta = inf
+        leader = None
+        for entity in lane:
+            front = entity.pos[axis] + length if direction else -entity.pos[axis]
+            speed = abs(entity.v[axis])
+            held = blocked and front < line and line - front < hi
+            gap = None
+            if leader is not None:
+                gap = (leader.pos[axis] if direction else -leader.pos[axis] - length) - front
+                if gap <= 0:
+                    return 0
+                leader_speed = abs(leader.v[axis])
+
+            if speed:
+                quanta = min(quanta, (exit_line - front + length) / (speed * q))
+                if gap is not None and speed > leader_speed:
+                    quanta = min(quanta, (gap - lo) / ((speed - leader_speed) * q))
+                elif gap is not None and speed == leader_speed and gap - lo < 1e-6:
+                    # followers in step with their leader stop as soon as the rounding of both positions differs
+                    return 0
+                if blocked and front < line:
+                    quanta = min(quanta, (line - front - lo) / (speed * q))
+            elif not held:
+                if gap is None or gap >= hi:
+                    return 0
+                if leader_speed:
+                    quanta = min(quanta, (hi - gap) / (leader_speed * q))
+            leader = entity
+        return quanta
+
+    def idle_quanta(self, q):
+        # arrivals of a new traffic phase are not drawn until its first quantum is ticked
+        if not self.skip_idle or self.schedule_part != self.current_part or len(self.schedule) < 4:
+            return 0
+
+        quanta = min(self.schedule.values()) - self.ticks
+        period = int(self.max_time / 4)
+        quanta = min(quanta, ((self.current_part + 1) * period - self.sim_time) / q)
+        quanta = min(quanta, (self.max_time - self.sim_time) / q)
+
+        light = self.traffic_light
+        if light.state in (TrafficState.red_green, TrafficState.green_red) or \
+                (light.state == TrafficState.red) == light.control_sig:
+            quanta = min(quanta, (light.state_time_min[light.state.value] - light.state_time) / q)
+
+        for lanes, limit in ((self.car_lanes, 120), (self.pedestrian_lanes, 90)):
+            for lane in lanes.values():
+                if lane:
+                    quanta = min(quanta, (limit - lane.front.cross_time) / q)
+
+        cars_blocked = light.state != TrafficState.green
+        peds_blocked = light.state != TrafficState.red
+        for direction in (True, False):
+            quanta = min(quanta, self.idle_lane(self.car_lanes[direction], direction, 0, 4, 0.5, 1.5,
+                                                0 if direction else -self.zebra_width,
+                                                self.zebra_width + self.road_segment if direction else
+                                                self.road_segment, cars_blocked, q))
+            quanta = min(quanta, self.idle_lane(self.pedestrian_lanes[direction], direction, 1, 0.5, 0.1, 0.5,
+                                                0 if direction else -self.road_width,
+                                                self.road_width + 2 * self.zebra_width if direction else
+                                                2 * self.zebra_width, peds_blocked, q))
+            if quanta < 2:
+                return 0
+        # keep one quantum of margin against rounding, the event itself is ticked normally
+        return int(quanta) - 1
+
+    def skip(self, quanta, q):
+        # the additions of Game.tick are repeated one quantum at a time, rounding stays bit for bit the same
+        steps = range(quanta)
+        light = self.traffic_light
+        for _ in steps:
+            light.state_time += q
+        for lanes in (self.car_lanes, self.pedestrian_lanes):
+            for lane in lanes.values():
+                for entity in lane:
+                    for _ in steps:
+                        entity.cross_time += q
+                    if entity.v[0] or entity.v[1]:
+                        x, y = entity.pos
+                        vx, vy = entity.v[0] * q, entity.v[1] * q
+                        for _ in steps:
+                            x += vx
+                            y += vy
+                        entity.pos = (x, y)
+
+        if light.state == TrafficState.green:
+            share = "green_time"
+        elif light.state == TrafficState.red:
+            share = "red_time"
+        else:
+            share = "switch_time"
+        sim_time, share_time = self.sim_time, getattr(self, share)
+        for _ in steps:
+            sim_time += q
+            share_time += q
+        self.sim_time = sim_time
+        setattr(self, share, share_time)
+        self.ticks += quanta
+
+    def tick(self, dt):
+        quanta = max(1, round(dt / self.step))
+        q = dt / quanta
+        while quanta and not self.go:
+            idle = min(self.idle_quanta(q), quanta)
+            if idle:
+                start = time.perf_counter()
+                self.skip(idle, q)
+                if self.perf is not None:
+                    self.perf.add("skip", start)
+                quanta -= idle
+            if quanta:
+                super().tick(q)
+                quanta -= 1
+
+    def snapshot(self):
+        return super().snapshot(), tuple(self.schedule.items()), self.schedule_part
+
+    def restore(self, state):
+        state, schedule, self.schedule_part = state
+        super().restore(state)
+        self.schedule = dict(schedule)
+
+    def restart(self, seed=None):
+        super().restart(seed)
+        self.schedule = {}
+        self.schedule_part = None
+
+
+def run(game, period):
+    ticks = 0
+    start = time.perf_counter()
+    while not game.go:
+        game.set([ticks % 2 == 0])
+        game.tick(period)
+        ticks += 1
+    return time.perf_counter() - start
+
+
+def main():
+    max_time, period = 3600, 30
+    print("comparing engines on {}s episodes, light switched every {}s...".format(max_time, period))
+    for seed in range(5):
+        fixed = EventGame(max_time, gui=False, skip_idle=False, seed=seed)
+        fixed_time = run(fixed, period)
+        event = EventGame(max_time, gui=False, seed=seed)
+        event_time = run(event, period)
+        print("seed {}: fitness {:7.1f} / {:7.1f}, crossed {}+{} / {}+{}, {:.2f}s / {:.2f}s ({:.1f}x)".format(
+            seed, fixed.fitness, event.fitness, fixed.cars_crossed, fixed.peds_crossed, event.cars_crossed,
+            event.peds_crossed, fixed_time, event_time, fixed_time / event_time))
+
+
+if __name__ == "__main__":
+    main()
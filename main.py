@@ -1,85 +1,213 @@
 import argparse
+import asyncio
+import json
+import os
 import time
 
-import pynlab
-
-from traffic_env import Game
+from common import above_zero
+from traffic_env import Game, PerfCounters
+from transport import LoopbackTransport, NLabTransport
 
 __author__ = 'leon.ljsh'
 
 
-def above_zero(string):
-    value = int(string)
-    if value <= 0:
-        msg = "{} not above zero".format(value)
-        raise argparse.ArgumentTypeError(msg)
-    return value
-
-
-parser = argparse.ArgumentParser(description="traffic environment for nlab")
-parser.add_argument("-u", "--uri",
-                    help="connection URI in format '[tcp|winpipe]://hostname(/pipe_name|:port)'(default: %(default)s",
-                    metavar="uri", type=str, dest="connection_uri", default="tcp://127.0.0.1:5005")
-parser.add_argument("-t", "--time", help="simulation time in seconds (default: %(default)s)",
-                    metavar="sec", type=above_zero, dest="time", default=3600)
-parser.add_argument("--no-gui", help="do not show gui", action="store_false",
-                    dest="gui")
-
-args = parser.parse_args()
-
-GUI = args.gui
-
-print("initializing... ", end="")
-
-esi = pynlab.EStartInfo()
-esi.count = 1
-esi.incount = 13
-esi.outcount = 1
-esi.mode = pynlab.SendModes.specified
-
-last_time = time.perf_counter()
-
-lab = pynlab.NLab(args.connection_uri)
-game = Game(args.time, args.gui)
-print("complete")
-
-print("connenting to nlab at {}... ".format(args.connection_uri), end="", flush=True)
-lab.connect()
-print("connected")
-
-print("waiting for start information from nlab... ", end="", flush=True)
-lab.set_start_info(esi)
-lab.get_start_info()
-print("ok")
-
-print("working")
-while lab.is_ok != pynlab.VerificationHeader.stop:
-    while not game.go:
-        esdi = pynlab.ESendInfo()
-        esdi.head = pynlab.VerificationHeader.ok
-        game.outputs = game.get()
-        esdi.data = [game.outputs]
-        lab.set(esdi)
-
-        get = lab.get()
-        if lab.is_ok == pynlab.VerificationHeader.stop:
-            print("get stop header from nlab. stopping")
-            exit()
-        game.set(get.data[0])
-
-        game.tick(1 / 15)
-        new_time = time.perf_counter()
-        if new_time - last_time > 1 / 30:
-            last_time = new_time
-            game.dispatch_messages()
-            game.draw()
-
-    eri = pynlab.ERestartInfo()
-    eri.result = [game.fitness]
-    lab.restart(eri)
-    game.restart()
-
-    lab.get()
-    if lab.is_ok == pynlab.VerificationHeader.stop:
-        print("get stop header from nlab. stopping")
-        exit()
+def dump_profile(path, perf, games):
+    with open(path, "w") as f:
+        json.dump({"time": time.time(), "loop": perf.stats(), "games": [g.perf_stats() for g in games]}, f, indent=2)
+
+
+def print_profile(perf, games):
+    phases = perf.stats()
+    for g in games:
+        for name, phase in g.perf_stats()["phases"].items():
+            total = phases.setdefault("game." + name, {"calls": 0, "seconds": 0})
+            total["calls"] += phase["calls"]
+            total["seconds"] += phase["seconds"]
+    spent = sum(phase["seconds"] for name, phase in phases.items() if not name.startswith("game.")) or 1
+    for name, phase in sorted(phases.items(), key=lambda item: -item[1]["seconds"]):
+        print("  {:28} {:9} calls {:9.3f}s {:6.1%} {:9.1f}us".format(
+            name, phase["calls"], phase["seconds"], phase["seconds"] / spent, phase["seconds"] / phase["calls"] * 1e6))
+    print("  {} cars, {} pedestrians on the road".format(sum(g.perf_stats()["cars"] for g in games),
+                                                       sum(g.perf_stats()["pedestrians"] for g in games)))
+
+
+def show(game, renderer):
+    # draws the first environment in this process or hands it to the renderer, tells whether the window was closed
+    if renderer is None:
+        game.dispatch_messages()
+        game.draw()
+        return game.closed
+    renderer.publish(game)
+    if renderer.restart_requested():
+        game.restart()
+    return renderer.closed
+
+
+async def serve_group(transport, games, decision_period, aggregate, verbose, perf, display):
+    await transport.open(len(games))
+    last_time = time.perf_counter()
+    while True:
+        observations = [g.get() for g in games]
+        while not all(g.go for g in games):
+            start = time.perf_counter()
+            actions = await transport.exchange(observations)
+            received = time.perf_counter()
+            if actions is None:
+                if verbose:
+                    print("get stop header from nlab. stopping")
+                return False
+            # finished environments keep reporting their last state and ignore their actions until the restart
+            observations = [g.step(inputs, decision_period, aggregate=aggregate) for g, inputs in zip(games, actions)]
+            new_time = time.perf_counter()
+            if perf is not None:
+                perf.add("exchange", start, received)
+                perf.add("step", received, new_time)
+
+            if display is not None and new_time - last_time > 1 / 30:
+                last_time = new_time
+                closed = display()
+                if perf is not None:
+                    perf.add("draw", new_time)
+                if closed:
+                    print("window closed. stopping")
+                    return True
+
+        if verbose:
+            print("episode done, fitness {:.0f}, {:.0f}us per physics step".format(
+                games[0].fitness, sum(g.substep_time for g in games) / max(1, sum(g.substeps for g in games)) * 1e6))
+        if not await transport.restart([g.fitness for g in games]):
+            if verbose:
+                print("get stop header from nlab. stopping")
+            return False
+        for g in games:
+            g.restart()
+
+
+async def serve(transports, games, decision_period=1, aggregate="last", verbose=True, profile=None, renderer=None,
+                telemetry=None):
+    # every transport serves its own slice of the environments, one waits for its controller while others step
+    count = min(len(transports), len(games))
+    groups = [games[i * len(games) // count:(i + 1) * len(games) // count] for i in range(count)]
+    perf = PerfCounters() if profile is not None else None
+    display = (lambda: show(games[0], renderer)) if renderer is not None or games[0].gui else None
+    tasks = {asyncio.ensure_future(serve_group(transport, group, decision_period, aggregate, verbose, perf,
+                                               display if i == 0 else None))
+             for i, (transport, group) in enumerate(zip(transports, groups))}
+
+    last_dump = time.perf_counter()
+    periodic = profile is not None or telemetry is not None
+    while tasks:
+        done, tasks = await asyncio.wait(tasks, timeout=10 if periodic else None, return_when=asyncio.FIRST_COMPLETED)
+        if periodic and time.perf_counter() - last_dump > 10:
+            last_dump = time.perf_counter()
+            if profile is not None:
+                dump_profile(profile, perf, games)
+            if telemetry is not None:
+                telemetry.export()
+        if tasks and any(task.result() for task in done):
+            # the window was closed, the other groups are dropped in the middle of their exchange
+            for task in tasks:
+                task.cancel()
+            await asyncio.wait(tasks)
+            break
+    for transport in transports:
+        transport.close()
+    if profile is not None:
+        print_profile(perf, games)
+        dump_profile(profile, perf, games)
+    if telemetry is not None:
+        telemetry.export()
+
+
+def run(transports, games, **kwargs):
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(serve(transports, games, **kwargs))
+    finally:
+        loop.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="traffic environment for nlab")
+    parser.add_argument("-u", "--uri",
+                        help="connection URI in format '[tcp|winpipe]://hostname(/pipe_name|:port)'"
+                             "(default: %(default)s",
+                        metavar="uri", type=str, dest="connection_uri", default="tcp://127.0.0.1:5005")
+    parser.add_argument("-t", "--time", help="simulation time in seconds (default: %(default)s)",
+                        metavar="sec", type=above_zero, dest="time", default=3600)
+    parser.add_argument("-c", "--count", help="number of environments served (default: %(default)s)",
+                        metavar="n", type=above_zero, dest="count", default=1)
+    parser.add_argument("-g", "--groups", help="split the environments over this many nlab sessions, one steps "
+                                               "while the others wait for their actions (default: %(default)s)",
+                        metavar="n", type=above_zero, dest="groups", default=1)
+    parser.add_argument("-d", "--decision-period", help="physics steps of 1/15 s per controller decision "
+                                                        "(default: %(default)s)",
+                        metavar="n", type=above_zero, dest="decision_period", default=1)
+    parser.add_argument("-a", "--aggregate", help="how sensors of the steps between decisions are reported "
+                                                  "(default: %(default)s)",
+                        choices=("last", "any", "max"), dest="aggregate", default="last")
+    parser.add_argument("--profile", help="time the stages of the exchange and the phases of every tick, print them "
+                                          "at the end and dump them to this json file every 10s",
+                        metavar="file", type=str, dest="profile", default=None)
+    parser.add_argument("--renderer", help="draw the gui in a separate process", action="store_true",
+                        dest="renderer")
+    parser.add_argument("--loopback", help="answer with the rule controller in process for this many episodes "
+                                           "instead of connecting to nlab",
+                        metavar="n", type=above_zero, dest="loopback", default=None)
+    parser.add_argument("--latency", help="simulated round trip of the --loopback controller in ms "
+                                          "(default: %(default)s)",
+                        metavar="ms", type=float, dest="latency", default=0)
+    parser.add_argument("--packed", help="send every observation as one 13 bit mask, nlab has to be set up for a "
+                                         "single input, the actions stay as they are",
+                        action="store_true", dest="packed")
+    parser.add_argument("--record", help="record every tick of every environment to a numbered subdirectory of this "
+                                         "directory, see recorder.py for the replay",
+                        metavar="dir", type=str, dest="record", default=None)
+    parser.add_argument("--telemetry", help="sample queues, waits, light phases and fitness of every environment and "
+                                            "export them every 10s to this Prometheus textfile (.prom), csv (.csv) "
+                                            "or json lines file",
+                        metavar="file", type=str, dest="telemetry", default=None)
+    parser.add_argument("--telemetry-period", help="physics steps between two telemetry samples "
+                                                   "(default: %(default)s)",
+                        metavar="n", type=above_zero, dest="telemetry_period", default=15)
+    parser.add_argument("--no-gui", help="do not show gui", action="store_false",
+                        dest="gui")
+
+    args = parser.parse_args()
+
+    print("initializing... ", end="")
+    if args.loopback is None:
+        transports = [NLabTransport(args.connection_uri, args.packed) for _ in range(args.groups)]
+    else:
+        transports = [LoopbackTransport(args.loopback, latency=args.latency / 1000, packed=args.packed)
+                      for _ in range(args.groups)]
+    renderer = None
+    if args.gui and args.renderer:
+        from renderer import Renderer
+        renderer = Renderer(args.time)
+    games = [Game(args.time, args.gui and renderer is None and i == 0, profile=args.profile is not None)
+             for i in range(args.count)]
+    if args.record is not None:
+        from recorder import Recorder
+        for i, game in enumerate(games):
+            game.recorder = Recorder(os.path.join(args.record, str(i)))
+    telemetry = None
+    if args.telemetry is not None:
+        from telemetry import Telemetry
+        telemetry = Telemetry(args.telemetry, args.telemetry_period)
+        for game in games:
+            game.telemetry = telemetry.probe()
+    print("complete")
+
+    print("working")
+    run(transports, games, decision_period=args.decision_period, aggregate=args.aggregate, profile=args.profile,
+        renderer=renderer, telemetry=telemetry)
+    if renderer is not None:
+        renderer.close()
+    for game in games:
+        if game.recorder is not None:
+            game.recorder.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+import argparse
+import multiprocessing
+import os
+import queue
+import time
+import traceback
+from collections import Counter
+from functools import partial
+
+from common import above_zero, rule
+from traffic_env import Game
+
+__author__ = "leon.ljsh"
+
+
+def threshold(outputs, k):
+    return [not (outputs[1] or outputs[2]) or sum(outputs[3:]) >= k]
+
+
+def play(game, controller, cutoff=None, period=150):
+    # every `period` ticks the episode stops once even its best end can not reach the cutoff
+    while not game.go:
+        game.set(controller(game.get()))
+        game.tick(1 / 15)
+        if cutoff is not None and game.ticks % period == 0:
+            bound = game.fitness_bound()
+            if bound < cutoff:
+                return bound, "cutoff"
+    return game.fitness, "fail" if game.sim_time <= game.max_time else "time"
+
+
+def configure(game, scenario):
+    # settings a restart does not reset are given to the constructor, see worker
+    if "gen_possibilities" in scenario:
+        game.gen_possibilities = [tuple(possibilities) for possibilities in scenario["gen_possibilities"]]
+        if game.arrivals_dt is not None:
+            game.sample_arrivals()
+    if "state_time_min" in scenario:
+        game.traffic_light.state_time_min = list(scenario["state_time_min"])
+    if "sensors" in scenario:
+        game.sensors = list(scenario["sensors"])
+
+
+def worker(max_time, tasks, results, arrivals_dt=None, cache=None):
+    game = Game(max_time, gui=False, arrivals_dt=arrivals_dt)
+    results.put(None)
+
+    for episode, controller, seed, cutoff, scenario in iter(tasks.get, None):
+        try:
+            results.put((episode,) + episode_report(game, max_time, arrivals_dt, cache, controller, seed, cutoff,
+                                                    scenario))
+        except Exception:
+            # the supervisor waits for a report of every episode, a failed one reports why
+            results.put((episode, {"error": traceback.format_exc()}, False))
+
+
+def episode_report(game, max_time, arrivals_dt, cache, controller, seed, cutoff, scenario):
+    key = None
+    if cache is not None:
+        key = cache.key(dict({"max_time": max_time, "arrivals_dt": arrivals_dt}, **(scenario or {})), seed,
+                        controller, cutoff)
+    report = cache.get(key) if key is not None else None
+    if report is not None:
+        return report, True
+    if scenario:
+        # a game of its own, the shared one keeps the configuration of the pool
+        target = Game(scenario.get("max_time", max_time), gui=False, seed=seed, arrivals_dt=arrivals_dt)
+        configure(target, scenario)
+    else:
+        target = game
+        target.restart(seed)
+    bound, reason = play(target, controller, cutoff)
+    report = {"fitness": target.fitness, "bound": bound, "reason": reason, "sim_time": target.sim_time}
+    if key is not None:
+        cache.put(key, report)
+    return report, False
+
+
+class Pool:
+    """Headless workers, each reusing one Game for every episode it takes from the shared queue
+
+    With `arrivals_dt` the workers sample the traffic of an episode ahead, the fitness bound of a cut episode then
+    counts only the arrivals still to come instead of assuming any number of them. With a `cache` the workers look
+    up every episode on a fixed seed before they run it and store it after.
+    """
+
+    def __init__(self, workers, max_time, arrivals_dt=None, cache=None):
+        self.tasks = multiprocessing.Queue()
+        self.results = multiprocessing.Queue()
+        self.sim_time = 0
+        self.hits = 0
+        self.reports = []
+        self.workers = [multiprocessing.Process(target=worker,
+                                                args=(max_time, self.tasks, self.results, arrivals_dt, cache),
+                                                daemon=True)
+                        for _ in range(workers)]
+        for w in self.workers:
+            w.start()
+        for _ in self.workers:
+            self.result()
+
+    def result(self):
+        # a worker that died without a report, killed or out of memory, would leave the queue empty for good
+        while True:
+            try:
+                return self.results.get(timeout=1)
+            except queue.Empty:
+                dead = sum(not w.is_alive() for w in self.workers)
+                if dead:
+                    raise RuntimeError("{} of {} workers died".format(dead, len(self.workers)))
+
+    def run(self, jobs):
+        # (controller, seed, cutoff, scenario) for each episode, the reports come back in the same order
+        for episode, (controller, seed, cutoff, scenario) in enumerate(jobs):
+            self.tasks.put((episode, controller, seed, cutoff, scenario))
+        reports = [None] * len(jobs)
+        errors = []
+        for _ in jobs:
+            episode, report, cached = self.result()
+            if "error" in report:
+                errors.append((episode, report["error"]))
+                continue
+            report["cached"] = cached
+            reports[episode] = report
+            if cached:
+                self.hits += 1
+            else:
+                self.sim_time += report["sim_time"]
+        if errors:
+            episode, error = errors[0]
+            raise RuntimeError("{} of {} episodes failed, episode {}:\n{}".format(len(errors), len(jobs), episode,
+                                                                                 error))
+        return reports
+
+    def evaluate(self, controllers, seed=None, seeds=None, cutoff=None, race=None, scenario=None):
+        # with a seed every controller meets the same traffic, with several seeds the score is the mean over them
+        # and a race keeps only the `race` best controllers after every seed but the last. An episode stopped at
+        # the cutoff scores its bound, dropped controllers keep the mean of the seeds they ran.
+        seeds = [seed] if seeds is None else seeds
+        scores = [[] for _ in controllers]
+        self.reports = [[] for _ in controllers]
+        self.sim_time = 0
+        self.hits = 0
+        running = list(range(len(controllers)))
+        for number, seed in enumerate(seeds):
+            reports = self.run([(controllers[i], seed, cutoff, scenario) for i in running])
+            for episode, report in zip(running, reports):
+                scores[episode].append(report["bound"])
+                report["seed"] = seed
+                self.reports[episode].append(report)
+            if race is not None and number + 1 < len(seeds):
+                running.sort(key=lambda i: sum(scores[i]) / len(scores[i]), reverse=True)
+                running = sorted(running[:race])
+        return [sum(s) / len(s) for s in scores]
+
+    def close(self):
+        for _ in self.workers:
+            self.tasks.put(None)
+        for w in self.workers:
+            w.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="evaluate traffic controllers on a pool of headless workers")
+    parser.add_argument("-w", "--workers", help="number of worker processes (default: %(default)s)",
+                        metavar="n", type=above_zero, dest="workers", default=os.cpu_count())
+    parser.add_argument("-e", "--episodes", help="number of episodes to run (default: %(default)s)",
+                        metavar="n", type=above_zero, dest="episodes", default=64)
+    parser.add_argument("-t", "--time", help="simulation time in seconds (default: %(default)s)",
+                        metavar="sec", type=above_zero, dest="time", default=3600)
+    parser.add_argument("-s", "--seed", help="run every episode on the traffic of this seed, the first of several "
+                                             "with --seeds",
+                        metavar="n", type=int, dest="seed", default=None)
+    parser.add_argument("--seeds", help="run every controller on this many seeds", metavar="n", type=above_zero,
+                        dest="seeds", default=None)
+    parser.add_argument("--cutoff", help="stop an episode once its fitness can not reach this value anymore",
+                        metavar="f", type=float, dest="cutoff", default=None)
+    parser.add_argument("--race", help="keep only the k best controllers after every seed but the last",
+                        metavar="k", type=above_zero, dest="race", default=None)
+    parser.add_argument("--thresholds", help="evaluate threshold controllers, waiting for 0 to 9 sensors in turn, "
+                                             "instead of the rule", action="store_true", dest="thresholds")
+    parser.add_argument("--cache", help="reuse the results of episodes on fixed seeds stored in this directory",
+                        metavar="dir", type=str, dest="cache", default=None)
+    args = parser.parse_args()
+
+    seeds = None
+    if args.seeds is not None:
+        first = args.seed if args.seed is not None else 0
+        seeds = list(range(first, first + args.seeds))
+    controllers = [partial(threshold, k=i % 10) for i in range(args.episodes)] if args.thresholds \
+        else [rule] * args.episodes
+
+    print("starting {} workers... ".format(args.workers), end="", flush=True)
+    cache = None
+    if args.cache is not None:
+        from cache import Cache
+        cache = Cache(args.cache)
+    pool = Pool(args.workers, args.time, arrivals_dt=1 / 15, cache=cache)
+    print("ready")
+
+    start = time.perf_counter()
+    fitness = pool.evaluate(controllers, args.seed, seeds, args.cutoff, args.race)
+    elapsed = time.perf_counter() - start
+    pool.close()
+
+    episodes = sum(len(r) for r in pool.reports)
+    print("{} episodes in {:.1f}s: {:.2f} episodes/s, {:.0f} simulated s/s, mean fitness {:.0f}".format(
+        episodes, elapsed, episodes / elapsed, pool.sim_time / elapsed, sum(fitness) / len(fitness)))
+    reasons = Counter(report["reason"] for r in pool.reports for report in r)
+    print("{:.0f} simulated s, {} episodes from the cache, best fitness {:.0f}, ended by {}".format(
+        pool.sim_time, pool.hits, max(fitness), ", ".join("{} {}".format(k, v) for k, v in sorted(reasons.items()))))
+
+
+if __name__ == "__main__":
+    main()
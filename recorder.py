@@ -0,0 +1,257 @@
+import argparse
+import json
+import os
+import time
+from itertools import chain
+from operator import attrgetter
+
+import numpy as np
+
+from common import above_zero, phase_share
+from renderer import COUNTER_NAMES, place
+from traffic_env import Game, TrafficState
+from wire import PACKED, UNPACKED
+
+__author__ = "leon.ljsh"
+
+# one row per tick, lanes holds the entity counts of cars right, cars left, pedestrians down and pedestrians up whose
+# positions follow each other in the positions file on the ticks that are placed
+TICK = np.dtype([("episode", np.int32)] + [(name, np.float64) for name in COUNTER_NAMES] +
+                [("light", np.uint8), ("action", np.float32), ("observation", np.uint16), ("lanes", np.uint16, 4),
+                 ("placed", np.uint8)])
+POSITION = np.dtype([("x", np.float32), ("y", np.float32)])
+COUNTERS = attrgetter(*COUNTER_NAMES)
+# light, action, observation, the four lane counts and whether the positions were written
+STATES = 8
+POS = attrgetter("pos")
+VERSION = 2
+
+
+class Column:
+    """File of fixed-size records mapped in memory, preallocated and grown by whole chunks"""
+
+    def __init__(self, path, dtype, chunk):
+        self.path = path
+        self.dtype = dtype
+        self.chunk = chunk
+        self.length = 0
+        self.map = None
+        open(path, "wb").close()
+        self.grow(chunk)
+
+    def grow(self, capacity):
+        if self.map is not None:
+            self.map.flush()
+            self.map = None
+        with open(self.path, "r+b") as f:
+            f.truncate(capacity * self.dtype.itemsize)
+        self.map = np.memmap(self.path, self.dtype, "r+", shape=(capacity,))
+
+    def append(self, values):
+        end = self.length + len(values)
+        if end > len(self.map):
+            self.grow(-(-end // self.chunk) * self.chunk)
+        self.map[self.length:end] = values
+        self.length = end
+
+    def close(self):
+        self.map.flush()
+        self.map = None
+        with open(self.path, "r+b") as f:
+            f.truncate(self.length * self.dtype.itemsize)
+
+
+class Recorder:
+    """Trajectory of a game written to `directory` as it runs, attach it with `game.recorder = Recorder(...)`
+
+    Every tick the recorder only extends three lists of plain numbers, keeping the position tuples themselves alive
+    until a flush costs more in allocation. Copying the positions is most of that, they are written on the first and
+    last tick of an episode and every `positions_every` ticks, the row of counters, light, action and observation on
+    every tick. Every `buffer` ticks and on restarts the lists are copied to the mapped files, and the counts in
+    meta.json follow, so a recording that was not closed is readable up to its last flush.
+    """
+
+    def __init__(self, directory, positions_every=1, buffer=1024, chunk=1 << 16):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.positions_every = positions_every
+        self.buffer = buffer
+        self.ticks = Column(os.path.join(directory, "ticks.bin"), TICK, chunk)
+        self.positions = Column(os.path.join(directory, "positions.bin"), POSITION, 16 * chunk)
+        self.episode = 0
+        self.length = 0
+        self.counters = []
+        self.states = []
+        self.coordinates = []
+
+    def record(self, game):
+        placed = (game.ticks - 1) % self.positions_every == 0 or game.go
+        cars_right, cars_left = game.car_lanes[True].queue, game.car_lanes[False].queue
+        pedestrians_down, pedestrians_up = game.pedestrian_lanes[True].queue, game.pedestrian_lanes[False].queue
+        self.counters.extend(COUNTERS(game))
+        # right after a restart the outputs are not a full observation yet
+        self.states.extend((game.traffic_light.state.value, game.inputs[0], PACKED.get(tuple(game.outputs), 0),
+                            len(cars_right), len(cars_left), len(pedestrians_down), len(pedestrians_up), placed))
+        if placed:
+            self.coordinates.extend(chain.from_iterable(map(POS, chain(cars_right, cars_left, pedestrians_down,
+                                                                       pedestrians_up))))
+        self.length += 1
+        if self.length == self.buffer:
+            self.flush()
+
+    def restart(self):
+        self.flush()
+        self.episode += 1
+
+    def flush(self):
+        if self.length:
+            rows = np.empty(self.length, TICK)
+            counters = np.array(self.counters, np.float64).reshape(self.length, len(COUNTER_NAMES))
+            states = np.array(self.states, np.float64).reshape(self.length, STATES)
+            rows["episode"] = self.episode
+            for i, name in enumerate(COUNTER_NAMES):
+                rows[name] = counters[:, i]
+            rows["light"], rows["action"], rows["observation"] = states[:, 0], states[:, 1], states[:, 2]
+            rows["lanes"], rows["placed"] = states[:, 3:7], states[:, 7]
+            self.ticks.append(rows)
+        if self.coordinates:
+            self.positions.append(np.fromiter(self.coordinates, np.float32, len(self.coordinates)).view(POSITION))
+        self.length = 0
+        self.counters = []
+        self.states = []
+        self.coordinates = []
+        with open(os.path.join(self.directory, "meta.json"), "w") as f:
+            json.dump({"version": VERSION, "ticks": self.ticks.length, "positions": self.positions.length,
+                       "positions_every": self.positions_every}, f)
+
+    def close(self):
+        self.flush()
+        self.ticks.close()
+        self.positions.close()
+
+
+def mapped(path, dtype, length):
+    if not length:
+        return np.zeros(0, dtype)
+    return np.memmap(path, dtype, "r", shape=(length,))
+
+
+class Replay:
+    """Recording read back from its mapped files, any tick is shown without simulating up to it"""
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+        if meta["version"] != VERSION:
+            raise ValueError("unknown recording version {}".format(meta["version"]))
+        self.ticks = mapped(os.path.join(directory, "ticks.bin"), TICK, meta["ticks"])
+        self.positions = mapped(os.path.join(directory, "positions.bin"), POSITION, meta["positions"])
+        # where the entities of every tick start, ticks that are not placed have none, and the first tick of every
+        # episode
+        entities = self.ticks["lanes"].sum(axis=1, dtype=np.int64) * self.ticks["placed"]
+        self.offsets = np.concatenate(([0], np.cumsum(entities)))
+        self.placed = np.flatnonzero(self.ticks["placed"])
+        self.starts = np.concatenate(([0], np.flatnonzero(np.diff(self.ticks["episode"])) + 1, [len(self.ticks)]))
+
+    def __len__(self):
+        return len(self.ticks)
+
+    @property
+    def episodes(self):
+        return len(self.starts) - 1
+
+    def episode(self, index):
+        return range(self.starts[index], self.starts[index + 1])
+
+    def episode_of(self, index):
+        return int(np.searchsorted(self.starts, index, "right")) - 1
+
+    def seek(self, episode, sim_time):
+        ticks = self.episode(episode)
+        return ticks.start + min(len(ticks) - 1, int(np.searchsorted(self.ticks["sim_time"][ticks.start:ticks.stop],
+                                                                     sim_time)))
+
+    def lanes(self, index):
+        # between two placed ticks the entities stay where they were last written, every episode starts placed
+        index = self.placed[np.searchsorted(self.placed, index, "right") - 1]
+        row = self.ticks[index]
+        positions = self.positions[self.offsets[index]:self.offsets[index + 1]].tolist()
+        lanes = []
+        start = 0
+        for count in row["lanes"].tolist():
+            lanes.append(positions[start:start + count])
+            start += count
+        return lanes
+
+    def load(self, game, index):
+        row = self.ticks[index]
+        for name in COUNTER_NAMES:
+            setattr(game, name, row[name].item())
+        game.traffic_light.state = TrafficState(int(row["light"]))
+        game.inputs = [row["action"].item()]
+        game.outputs = list(UNPACKED[row["observation"]])
+        place(game, self.lanes(index))
+
+
+def record(directory, max_time, episodes, positions_every):
+    recorder = Recorder(directory, positions_every)
+    per_tick, share = phase_share(lambda game: setattr(game, "recorder", recorder), "record", max_time, episodes)
+    recorder.close()
+    print("recorded {} episodes to {}, positions every {} ticks, {:.2f}us per tick, {:+.1%} of the tick".format(
+        episodes, directory, positions_every, per_tick * 1e6, share))
+
+
+def play(replay, max_time):
+    import pygame
+
+    game = Game(max_time, gui=True)
+    index = 0
+    paused = False
+    while True:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                return
+            if event.type != pygame.KEYDOWN:
+                continue
+            episode = replay.episode_of(index)
+            sim_time = replay.ticks["sim_time"][index]
+            if event.key == pygame.K_SPACE:
+                paused = not paused
+            elif event.key in (pygame.K_LEFT, pygame.K_RIGHT):
+                index = replay.seek(episode, sim_time + (10 if event.key == pygame.K_RIGHT else -10))
+            elif event.key in (pygame.K_UP, pygame.K_DOWN):
+                episode = min(replay.episodes - 1, max(0, episode + (1 if event.key == pygame.K_UP else -1)))
+                index = replay.episode(episode).start
+        replay.load(game, index)
+        game.draw()
+        if not paused:
+            index = min(len(replay) - 1, index + 1)
+        time.sleep(1 / 15)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="record episodes of the rule controller or replay a recording, "
+                                                 "space pauses, left and right seek 10s, up and down switch episodes")
+    parser.add_argument("directory", help="directory of the recording")
+    parser.add_argument("-r", "--record", help="record this many episodes first", metavar="n", type=above_zero,
+                        dest="record", default=None)
+    parser.add_argument("-t", "--time", help="simulation time of a recorded episode in seconds "
+                                             "(default: %(default)s)",
+                        metavar="sec", type=above_zero, dest="time", default=3600)
+    parser.add_argument("-n", "--positions-every", help="write the positions of the entities every n-th tick and on "
+                                                        "the first and last one of an episode, everything else is "
+                                                        "written every tick (default: %(default)s)",
+                        metavar="n", type=above_zero, dest="positions_every", default=1)
+    parser.add_argument("--no-gui", help="do not replay", action="store_false", dest="gui")
+    args = parser.parse_args()
+
+    if args.record is not None:
+        record(args.directory, args.time, args.record, args.positions_every)
+    replay = Replay(args.directory)
+    print("{} episodes, {} ticks, {} positions".format(replay.episodes, len(replay), len(replay.positions)))
+    if args.gui:
+        play(replay, args.time)
+
+
+if __name__ == "__main__":
+    main()
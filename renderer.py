@@ -0,0 +1,157 @@
+import multiprocessing
+import time
+
+from common import rule
+from traffic_env import Car, Game, Lane, Pedestrian, TrafficState
+
+__author__ = "leon.ljsh"
+
+# layout of the shared buffer: flags, then a frame guarded by a sequence number that is odd while it is written
+SEQUENCE, CLOSED, RESTART, STOP = range(4)
+COUNTERS = 4
+COUNTER_NAMES = ("sim_time", "red_time", "green_time", "switch_time", "cars_crossed", "peds_crossed", "cars_wait",
+                 "peds_wait", "fitness")
+LIGHT = COUNTERS + len(COUNTER_NAMES)
+INPUT = LIGHT + 1
+OUTPUTS = INPUT + 1
+OUTPUT_COUNT = 13
+OUTPUT_LENGTH = OUTPUTS + OUTPUT_COUNT
+ENTITY_COUNTS = OUTPUT_LENGTH + 1
+ENTITIES = ENTITY_COUNTS + 2
+
+
+def frame_size(capacity):
+    return ENTITIES + 4 * capacity
+
+
+def publish(buffer, game, capacity):
+    values = [getattr(game, name) for name in COUNTER_NAMES]
+    values.append(game.traffic_light.state.value)
+    values.append(game.inputs[0])
+    outputs = game.outputs[:OUTPUT_COUNT]
+    values.extend(outputs)
+    values.extend([0] * (OUTPUT_COUNT - len(outputs)))
+    values.append(len(outputs))
+
+    cars = [coordinate for lane in game.car_lanes.values() for car in lane for coordinate in car.pos][:2 * capacity]
+    pedestrians = [coordinate for lane in game.pedestrian_lanes.values() for p in lane
+                   for coordinate in p.pos][:2 * capacity]
+    values.append(len(cars) // 2)
+    values.append(len(pedestrians) // 2)
+
+    buffer[SEQUENCE] += 1
+    buffer[COUNTERS:ENTITIES] = values
+    buffer[ENTITIES:ENTITIES + len(cars)] = cars
+    buffer[ENTITIES + 2 * capacity:ENTITIES + 2 * capacity + len(pedestrians)] = pedestrians
+    buffer[SEQUENCE] += 1
+
+
+def read(buffer, capacity):
+    # the writer never waits, a frame caught in the middle of an update is dropped until the next one
+    sequence = buffer[SEQUENCE]
+    frame = buffer[:frame_size(capacity)]
+    if sequence % 2 or buffer[SEQUENCE] != sequence:
+        return None
+    return frame
+
+
+def load(game, frame, capacity):
+    for name, value in zip(COUNTER_NAMES, frame[COUNTERS:LIGHT]):
+        setattr(game, name, value)
+    game.traffic_light.state = TrafficState(int(frame[LIGHT]))
+    game.inputs = [frame[INPUT]]
+    game.outputs = [int(value) for value in frame[OUTPUTS:OUTPUTS + int(frame[OUTPUT_LENGTH])]]
+
+    cars, pedestrians = int(frame[ENTITY_COUNTS]), int(frame[ENTITY_COUNTS + 1])
+    first = ENTITIES + 2 * capacity
+    place(game, ([(frame[i], frame[i + 1]) for i in range(ENTITIES, ENTITIES + 2 * cars, 2)], (),
+                 [(frame[i], frame[i + 1]) for i in range(first, first + 2 * pedestrians, 2)], ()))
+
+
+def place(game, lanes):
+    # positions of cars right, cars left, pedestrians down and pedestrians up, enough for drawing
+    game.release()
+    game.car_lanes = {True: Lane(), False: Lane()}
+    game.pedestrian_lanes = {True: Lane(), False: Lane()}
+    targets = ((game.car_lanes, True, Car), (game.car_lanes, False, Car), (game.pedestrian_lanes, True, Pedestrian),
+               (game.pedestrian_lanes, False, Pedestrian))
+    for (target, direction, kind), positions in zip(targets, lanes):
+        for pos in positions:
+            game.spawn(target, game.entity(kind, pos, direction))
+
+
+def render(buffer, max_time, fps, capacity):
+    import pygame
+
+    game = Game(max_time, gui=True)
+    shown = 0
+    while not buffer[STOP]:
+        start = time.perf_counter()
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                buffer[CLOSED] = 1
+                return
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_RETURN:
+                buffer[RESTART] = 1
+
+        frame = read(buffer, capacity)
+        if frame is not None and frame[SEQUENCE] != shown:
+            shown = frame[SEQUENCE]
+            load(game, frame, capacity)
+            game.draw()
+        time.sleep(max(0, 1 / fps - (time.perf_counter() - start)))
+
+
+class Renderer:
+    """Window drawn by a separate process from the frames a game publishes into shared memory
+
+    Publishing copies a few hundred numbers and never waits for the window, entities beyond `capacity` per kind
+    are not shown.
+    """
+
+    def __init__(self, max_time, fps=30, capacity=256):
+        self.capacity = capacity
+        self.buffer = multiprocessing.RawArray("d", frame_size(capacity))
+        self.process = multiprocessing.Process(target=render, args=(self.buffer, max_time, fps, capacity),
+                                               daemon=True)
+        self.process.start()
+
+    def publish(self, game):
+        publish(self.buffer, game, self.capacity)
+
+    @property
+    def closed(self):
+        return bool(self.buffer[CLOSED]) or not self.process.is_alive()
+
+    def restart_requested(self):
+        requested = bool(self.buffer[RESTART])
+        self.buffer[RESTART] = 0
+        return requested
+
+    def close(self):
+        self.buffer[STOP] = 1
+        self.process.join()
+
+
+def main():
+    renderer = Renderer(3600)
+    game = Game(3600, gui=False)
+    frames = 0
+    spent = 0
+    published = time.perf_counter()
+    while not renderer.closed and not game.go:
+        game.set(rule(game.get()))
+        game.tick(1 / 15)
+        if renderer.restart_requested():
+            game.restart()
+        if time.perf_counter() - published > 1 / 60:
+            published = time.perf_counter()
+            renderer.publish(game)
+            spent += time.perf_counter() - published
+            frames += 1
+    renderer.close()
+    print("{} frames published, {:.0f}us each".format(frames, spent / max(1, frames) * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import argparse
+import csv
+import itertools
+import json
+import os
+import time
+from functools import partial
+
+from cache import Cache
+from common import above_zero, rule
+from pool import Pool, threshold
+
+__author__ = "leon.ljsh"
+
+# the settings a scenario may change, see pool.configure
+PARAMETERS = ("max_time", "gen_possibilities", "state_time_min", "sensors")
+# the controllers read the 13 values of Game.get, two lines of this many sensors among them
+SENSORS = 5
+
+
+def parameter(string):
+    name, _, values = string.partition("=")
+    if name not in PARAMETERS:
+        raise argparse.ArgumentTypeError("{} is not one of {}".format(name, ", ".join(PARAMETERS)))
+    try:
+        values = json.loads(values)
+    except ValueError as error:
+        raise argparse.ArgumentTypeError("values of {} are not json: {}".format(name, error))
+    if not isinstance(values, list) or not values:
+        raise argparse.ArgumentTypeError("values of {} are not a json list".format(name))
+    if name == "sensors":
+        for sensors in values:
+            if not isinstance(sensors, list) or len(sensors) != SENSORS or \
+                    not all(isinstance(s, (int, float)) and not isinstance(s, bool) for s in sensors):
+                raise argparse.ArgumentTypeError("{} is not a list of {} sensor distances".format(
+                    json.dumps(sensors), SENSORS))
+    return name, values
+
+
+def grid(parameters):
+    names = [name for name, _ in parameters]
+    for values in itertools.product(*(values for _, values in parameters)):
+        yield dict(zip(names, values))
+
+
+def label(controller):
+    if isinstance(controller, partial):
+        return "{}({})".format(controller.func.__name__, ", ".join(
+            "{}={}".format(name, value) for name, value in sorted(controller.keywords.items())))
+    return controller.__name__
+
+
+def sweep(pool, scenarios, controllers, seeds):
+    # every episode of the whole grid is queued at once, the workers never wait for a slow scenario
+    jobs = [(controller, seed, None, scenario)
+            for scenario in scenarios for controller in controllers for seed in seeds]
+    reports = iter(pool.run(jobs))
+    rows = []
+    for scenario in scenarios:
+        for controller in controllers:
+            episodes = [next(reports) for _ in seeds]
+            rows.append(dict({name: json.dumps(value) for name, value in scenario.items()},
+                             controller=label(controller), seeds=len(seeds),
+                             fitness=sum(r["fitness"] for r in episodes) / len(episodes),
+                             worst=min(r["fitness"] for r in episodes),
+                             fails=sum(r["reason"] == "fail" for r in episodes),
+                             sim_time=sum(r["sim_time"] for r in episodes),
+                             cached=sum(r["cached"] for r in episodes)))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="evaluate controllers over a grid of scenarios, reusing the results "
+                                                 "stored in the cache")
+    parser.add_argument("-p", "--parameter", help="values of a setting as a json list, for example "
+                                                  "'state_time_min=[[7, 6, 10, 3], [7, 6, 20, 3]]', one of {}, "
+                                                  "every combination is a scenario".format(", ".join(PARAMETERS)),
+                        metavar="name=values", type=parameter, dest="parameters", action="append", default=[])
+    parser.add_argument("-w", "--workers", help="number of worker processes (default: %(default)s)",
+                        metavar="n", type=above_zero, dest="workers", default=os.cpu_count())
+    parser.add_argument("-t", "--time", help="simulation time in seconds of scenarios that do not set max_time "
+                                             "(default: %(default)s)",
+                        metavar="sec", type=above_zero, dest="time", default=600)
+    parser.add_argument("--seeds", help="run every controller on the seeds from 0 to n - 1 (default: %(default)s)",
+                        metavar="n", type=above_zero, dest="seeds", default=4)
+    parser.add_argument("--thresholds", help="evaluate threshold controllers waiting for these numbers of sensors "
+                                             "besides the rule",
+                        metavar="k", type=int, nargs="*", dest="thresholds", default=[])
+    parser.add_argument("--cache", help="directory of the cache (default: %(default)s)", metavar="dir", type=str,
+                        dest="cache", default="cache")
+    parser.add_argument("--max-entries", help="least recently used results beyond this many are removed from the "
+                                              "cache (default: %(default)s)",
+                        metavar="n", type=above_zero, dest="max_entries", default=100000)
+    parser.add_argument("-o", "--output", help="csv file for the results table (default: %(default)s)",
+                        metavar="file", type=str, dest="output", default="sweep.csv")
+    args = parser.parse_args()
+
+    scenarios = list(grid(args.parameters))
+    controllers = [rule] + [partial(threshold, k=k) for k in args.thresholds]
+    seeds = list(range(args.seeds))
+    cache = Cache(args.cache, args.max_entries)
+
+    print("starting {} workers... ".format(args.workers), end="", flush=True)
+    pool = Pool(args.workers, args.time, arrivals_dt=1 / 15, cache=cache)
+    print("ready")
+
+    start = time.perf_counter()
+    rows = sweep(pool, scenarios, controllers, seeds)
+    elapsed = time.perf_counter() - start
+    pool.close()
+    cache.trim()
+
+    with open(args.output, "w", newline="") as f:
+        writer = csv.DictWriter(f, list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    for row in rows:
+        print("  ".join("{}={}".format(name, round(value) if isinstance(value, float) else value)
+                        for name, value in row.items()))
+    episodes = len(scenarios) * len(controllers) * len(seeds)
+    print("{} scenarios, {} episodes in {:.1f}s, {} from the cache, {:.0f} simulated s, written to {}".format(
+        len(scenarios), episodes, elapsed, pool.hits, pool.sim_time, args.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+import argparse
+import csv
+import json
+import os
+import time
+
+import numpy as np
+
+from common import above_zero, phase_share
+
+__author__ = "leon.ljsh"
+
+# queue lengths and the wait of the front, the longest one, of cars right, cars left, pedestrians down and up, then
+# the mean wait of the crossed, the shares of the light phases and the counters of the episode so far
+FIELDS = ("sim_time", "cars_right", "cars_left", "pedestrians_down", "pedestrians_up", "cars_right_wait",
+          "cars_left_wait", "pedestrians_down_wait", "pedestrians_up_wait", "cars_mean_wait", "peds_mean_wait",
+          "red_share", "green_share", "switch_share", "cars_crossed", "peds_crossed", "fitness")
+TOTALS = ("episodes", "samples")
+
+
+class Probe:
+    """Samples of one game every `period` ticks and at its end, attach it with `game.telemetry = telemetry.probe()`
+
+    The samples of an episode go to a ring of `capacity` rows allocated once. The ring is folded into the sums of
+    the telemetry whenever it is full, so every sample counts while the memory stays the same however long the
+    episode.
+    """
+
+    __slots__ = ("telemetry", "period", "ring", "length", "collected")
+
+    def __init__(self, telemetry, period, capacity):
+        self.telemetry = telemetry
+        self.period = period
+        self.ring = np.zeros((capacity, len(FIELDS)))
+        self.length = 0
+        self.collected = 0
+
+    def sample(self, game):
+        if game.ticks % self.period and not game.go:
+            return
+        cars_right, cars_left = game.car_lanes[True], game.car_lanes[False]
+        pedestrians_down, pedestrians_up = game.pedestrian_lanes[True], game.pedestrian_lanes[False]
+        sim_time = game.sim_time or 1
+        self.ring[self.length % len(self.ring)] = (
+            game.sim_time, len(cars_right), len(cars_left), len(pedestrians_down), len(pedestrians_up),
+            cars_right.front.cross_time if cars_right else 0, cars_left.front.cross_time if cars_left else 0,
+            pedestrians_down.front.cross_time if pedestrians_down else 0,
+            pedestrians_up.front.cross_time if pedestrians_up else 0,
+            game.cars_wait / game.cars_crossed if game.cars_crossed else 0,
+            game.peds_wait / game.peds_crossed if game.peds_crossed else 0,
+            game.red_time / sim_time, game.green_time / sim_time, game.switch_time / sim_time,
+            game.cars_crossed, game.peds_crossed, game.fitness)
+        self.length += 1
+        if game.go:
+            self.telemetry.collect(self, True)
+        elif self.length - self.collected == len(self.ring):
+            self.telemetry.collect(self)
+
+    def pending(self):
+        # rows since the last collection in the order they were written, never more than the ring holds
+        rows = self.ring.take(np.arange(self.collected, self.length) % len(self.ring), axis=0)
+        self.collected = self.length
+        return rows
+
+    def restart(self):
+        self.telemetry.collect(self)
+        self.length = 0
+        self.collected = 0
+
+
+class Telemetry:
+    """Samples of every probe summed up between exports, the mean and the maximum of each field over all of them
+
+    Every export writes one record to `path`, the format follows its extension: a Prometheus textfile for .prom,
+    replaced as a whole, a row appended for .csv and a json line appended otherwise.
+    """
+
+    def __init__(self, path, period=15, capacity=1024):
+        self.path = path
+        self.period = period
+        self.capacity = capacity
+        self.probes = []
+        self.totals = dict.fromkeys(TOTALS, 0)
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.sum = np.zeros(len(FIELDS))
+        self.max = np.zeros(len(FIELDS))
+        self.fitness = []
+
+    def probe(self):
+        probe = Probe(self, self.period, self.capacity)
+        self.probes.append(probe)
+        return probe
+
+    def collect(self, probe, finished=False):
+        rows = probe.pending()
+        if len(rows):
+            self.totals["samples"] += len(rows)
+            self.count += len(rows)
+            self.sum += rows.sum(axis=0)
+            np.maximum(self.max, rows.max(axis=0), out=self.max)
+        if finished:
+            self.totals["episodes"] += 1
+            self.fitness.append(probe.ring[(probe.length - 1) % len(probe.ring), FIELDS.index("fitness")])
+
+    def aggregate(self):
+        for probe in self.probes:
+            self.collect(probe)
+        record = {"time": time.time()}
+        record.update(self.totals)
+        record["episode_fitness"] = sum(self.fitness) / len(self.fitness) if self.fitness else 0
+        mean = self.sum / max(1, self.count)
+        for i, name in enumerate(FIELDS):
+            record[name + "_mean"] = mean[i].item()
+            record[name + "_max"] = self.max[i].item()
+        self.reset()
+        return record
+
+    def export(self):
+        record = self.aggregate()
+        extension = os.path.splitext(self.path)[1]
+        if extension == ".prom":
+            # the textfile collector may read at any time, the file is only ever replaced whole
+            lines = ["traffic_{}_total {}".format(name, record[name]) for name in TOTALS]
+            lines.append("traffic_episode_fitness {}".format(record["episode_fitness"]))
+            for name in FIELDS:
+                lines.append('traffic_{}{{stat="mean"}} {}'.format(name, record[name + "_mean"]))
+                lines.append('traffic_{}{{stat="max"}} {}'.format(name, record[name + "_max"]))
+            with open(self.path + ".tmp", "w") as f:
+                f.write("\n".join(lines) + "\n")
+            os.replace(self.path + ".tmp", self.path)
+        elif extension == ".csv":
+            new = not os.path.exists(self.path) or not os.path.getsize(self.path)
+            with open(self.path, "a", newline="") as f:
+                writer = csv.DictWriter(f, list(record))
+                if new:
+                    writer.writeheader()
+                writer.writerow(record)
+        else:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+        return record
+
+
+def share(max_time, episodes, period):
+    telemetry = Telemetry(os.devnull, period)
+    per_tick, fraction = phase_share(lambda game: setattr(game, "telemetry", telemetry.probe()), "telemetry",
+                                     max_time, episodes)
+    return per_tick, fraction, telemetry
+
+
+def main():
+    parser = argparse.ArgumentParser(description="cost of sampling telemetry of the rule controller, exported to a "
+                                                 "Prometheus textfile (.prom), csv (.csv) or json lines")
+    parser.add_argument("path", help="file to export to")
+    parser.add_argument("-e", "--episodes", help="number of episodes (default: %(default)s)", metavar="n",
+                        type=above_zero, dest="episodes", default=2)
+    parser.add_argument("-t", "--time", help="simulation time in seconds (default: %(default)s)",
+                        metavar="sec", type=above_zero, dest="time", default=600)
+    parser.add_argument("-r", "--repeats", help="runs of every period, in turns (default: %(default)s)",
+                        metavar="n", type=above_zero, dest="repeats", default=3)
+    args = parser.parse_args()
+
+    periods = (1, 15, 150)
+    results = {period: [] for period in periods}
+    for _ in range(args.repeats):
+        for period in periods:
+            results[period].append(share(args.time, args.episodes, period))
+    for period in periods:
+        runs = sorted(results[period], key=lambda result: result[1])
+        per_tick, fraction, telemetry = runs[len(runs) // 2]
+        telemetry.path = args.path
+        record = telemetry.export()
+        print("every {:3} ticks: {:.2f}us per tick, {:+.1%} of the tick ({:+.1%} to {:+.1%}), {} samples".format(
+            period, per_tick * 1e6, fraction, runs[0][1], runs[-1][1], record["samples"]))
+
+
+if __name__ == "__main__":
+    main()
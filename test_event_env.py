@@ -0,0 +1,51 @@
+import pytest
+
+from common import rule
+from event_env import EventGame
+from traffic_env import Game
+
+__author__ = "leon.ljsh"
+
+
+class Reference(Game):
+    """The fixed-step engine with the arrivals of EventGame, which draws them as gaps instead of one trial per tick"""
+
+    arrival = EventGame.arrival
+
+    def __init__(self, max_time, seed):
+        super().__init__(max_time, gui=False, seed=seed)
+        self.schedule = {}
+        self.schedule_part = None
+
+
+def pair(seed, max_time=600):
+    return EventGame(max_time, gui=False, seed=seed), Reference(max_time, seed)
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_controller_ticks(seed):
+    event, reference = pair(seed)
+    while not reference.go:
+        event.set(rule(event.get()))
+        reference.set(rule(reference.get()))
+        event.tick(1 / 15)
+        reference.tick(1 / 15)
+        assert Game.snapshot(event) == reference.snapshot()
+    assert event.go
+    assert event.fitness == reference.fitness
+
+
+@pytest.mark.parametrize("seed", range(4))
+@pytest.mark.parametrize("dt", (2, 30))
+def test_long_ticks(seed, dt):
+    event, reference = pair(seed)
+    decisions = 0
+    while not reference.go:
+        event.set([decisions % 2 == 0])
+        reference.set([decisions % 2 == 0])
+        event.tick(dt)
+        for _ in range(round(dt * 15)):
+            reference.tick(1 / 15)
+        decisions += 1
+        assert Game.snapshot(event) == reference.snapshot()
+    assert event.fitness == reference.fitness
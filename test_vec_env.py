@@ -0,0 +1,54 @@
+import numpy as np
+
+from common import PHASES, rule
+from traffic_env import Game
+from vec_env import VecGame, rule as vec_rule
+
+__author__ = "leon.ljsh"
+
+MAX_TIME = 300
+
+
+def statistics(cars_crossed, peds_crossed, cars_wait, peds_wait, sensors):
+    # per episode: crossings, mean waits and how often each of the 13 outputs was set
+    return np.column_stack([cars_crossed, peds_crossed, cars_wait / np.maximum(1, cars_crossed),
+                            peds_wait / np.maximum(1, peds_crossed), sensors])
+
+
+def game_statistics(episodes):
+    rows = []
+    for seed in range(episodes):
+        game = Game(MAX_TIME, gui=False, seed=seed)
+        game.gen_possibilities = list(PHASES)
+        sensors = np.zeros(13)
+        ticks = 0
+        while not game.go:
+            outputs = game.get()
+            sensors += outputs
+            ticks += 1
+            game.set(rule(outputs))
+            game.tick(1 / 15)
+        rows.append((game.cars_crossed, game.peds_crossed, game.cars_wait, game.peds_wait, sensors / ticks))
+    return statistics(*(np.array(column) for column in zip(*rows)))
+
+
+def vec_statistics(n):
+    vec = VecGame(n, MAX_TIME, seed=0)
+    vec.gen_possibilities[:] = np.array(PHASES)
+    sensors = np.zeros((n, 13))
+    ticks = np.zeros(n)
+    outputs = vec.get()
+    while not vec.go.all():
+        live = ~vec.go
+        sensors[live] += outputs[live]
+        ticks += live
+        outputs, _ = vec.step(vec_rule(outputs))
+    return statistics(vec.cars_crossed, vec.peds_crossed, vec.cars_wait, vec.peds_wait, sensors / ticks[:, None])
+
+
+def test_matches_game():
+    # the engines draw different random numbers, so only the means over many episodes of one phase order agree
+    game, vec = game_statistics(16), vec_statistics(128)
+    error = np.sqrt(game.var(axis=0) / len(game) + vec.var(axis=0) / len(vec))
+    difference = np.abs(game.mean(axis=0) - vec.mean(axis=0))
+    assert (difference <= 4 * error + 1e-9).all(), (game.mean(axis=0), vec.mean(axis=0), error)
@@ -1,17 +1,23 @@
+import copy
+import heapq
 import random
-import sys
 import time
+from array import array
+from bisect import bisect_right
+from collections import deque
 from enum import Enum
-from math import e
-
-try:
-    import pygame
-except ImportError:
-    pygame = None
+from math import e, floor, inf, log
+from operator import attrgetter, itemgetter
 
 __author__ = "leon.ljsh"
 
 
+def skip_random(generator, count):
+    # random() consumes two 32-bit words, getrandbits advances the generator the same way in one call
+    if count > 0:
+        generator.getrandbits(64 * count)
+
+
 class TrafficState(Enum):
     red = 0
     red_green = 1
@@ -20,6 +26,8 @@ class TrafficState(Enum):
 
 
 class TrafficLight:
+    __slots__ = ("state", "state_time", "state_time_min", "control_sig")
+
     def __init__(self):
         self.state = TrafficState.green
         self.state_time = 0
@@ -44,17 +52,84 @@ class TrafficLight:
                 self.state_time = 0
 
 
+class Lane:
+    """Entities moving in one direction, front (first spawned) to rear"""
+
+    __slots__ = ("queue", "spawned")
+
+    def __init__(self):
+        self.queue = deque()
+        self.spawned = 0
+
+    def __len__(self):
+        return len(self.queue)
+
+    def __iter__(self):
+        return iter(self.queue)
+
+    @property
+    def front(self):
+        return self.queue[0]
+
+    @property
+    def rear(self):
+        return self.queue[-1]
+
+    @property
+    def removed(self):
+        return self.spawned - len(self.queue)
+
+    def append(self, entity):
+        self.queue.append(entity)
+        self.spawned += 1
+
+    def pop_front(self):
+        return self.queue.popleft()
+
+
+class PerfCounters:
+    """Wall time and number of calls per named phase"""
+
+    __slots__ = ("phases",)
+
+    def __init__(self):
+        self.phases = {}
+
+    def add(self, name, start, end=None):
+        elapsed = (time.perf_counter() if end is None else end) - start
+        phase = self.phases.get(name)
+        if phase is None:
+            self.phases[name] = [elapsed, 1]
+        else:
+            phase[0] += elapsed
+            phase[1] += 1
+
+    def stats(self):
+        return {name: {"calls": calls, "seconds": seconds, "mean_us": seconds / calls * 1e6}
+                for name, (seconds, calls) in self.phases.items()}
+
+    def reset(self):
+        self.phases = {}
+
+
 class Car:
+    __slots__ = ("pos", "direction", "v", "a", "w", "h", "traffic", "game", "cross_time", "serial", "before")
+
     def __init__(self, pos, direction, traffic_light, game):
+        self.w = 4
+        self.h = 2
+        self.game = game
+        self.reset(pos, direction, traffic_light)
+
+    def reset(self, pos, direction, traffic_light):
         self.pos = pos
         self.direction = direction
         self.v = (0, 0)
         self.a = (0, 0)
-        self.w = 4
-        self.h = 2
         self.traffic = traffic_light
-        self.game = game
         self.cross_time = 0
+        self.serial = 0
+        self.before = 0
 
     def stop(self):
         self.v = (0, 0)
@@ -62,28 +137,22 @@ class Car:
     def start(self):
         self.v = (5 * (2 * self.direction - 1), 0)
 
-    def tick(self, dt):
+    def tick(self, dt, leader=None):
         self.cross_time += dt
-        self.v = (self.v[0] + self.a[0] * dt, self.v[1] + self.a[1] * dt)
+        if self.a[0] or self.a[1]:
+            self.v = (self.v[0] + self.a[0] * dt, self.v[1] + self.a[1] * dt)
         self.pos = (self.pos[0] + self.v[0] * dt, self.pos[1] + self.v[1] * dt)
         near = 1.5
 
         if self.direction is True:
-            try:
-                near = min(c.pos[0] - (self.pos[0] + self.w) for c in self.game.cars
-                           if c.direction and (c.pos[0] > self.pos[0] + self.w))
-            except ValueError:
-                pass
+            if leader is not None and leader.pos[0] > self.pos[0] + self.w:
+                near = leader.pos[0] - (self.pos[0] + self.w)
 
             if self.pos[0] + self.w < 0 and self.traffic.state != TrafficState.green:
                 near = min(-self.pos[0] - self.w, near)
         else:
-
-            try:
-                near = min(self.pos[0] - (c.pos[0] + c.w) for c in self.game.cars
-                           if not c.direction and (c.pos[0] + c.w < self.pos[0]))
-            except ValueError:
-                pass
+            if leader is not None and leader.pos[0] + leader.w < self.pos[0]:
+                near = self.pos[0] - (leader.pos[0] + leader.w)
 
             if self.pos[0] > self.game.zebra_width and self.traffic.state != TrafficState.green:
                 near = min(self.pos[0] - self.game.zebra_width, near)
@@ -95,15 +164,22 @@ class Car:
 
 
 class Pedestrian:
+    __slots__ = ("pos", "direction", "v", "a", "l", "traffic", "game", "cross_time", "serial", "before")
+
     def __init__(self, pos, direction, traffic_light, game):
+        self.l = 0.5
+        self.game = game
+        self.reset(pos, direction, traffic_light)
+
+    def reset(self, pos, direction, traffic_light):
         self.pos = pos
         self.direction = direction
         self.v = (0, 0)
         self.a = (0, 0)
-        self.l = 0.5
         self.traffic = traffic_light
-        self.game = game
         self.cross_time = 0
+        self.serial = 0
+        self.before = 0
 
     def stop(self):
         self.v = (0, 0)
@@ -111,27 +187,22 @@ class Pedestrian:
     def start(self):
         self.v = (0, 1 * (2 * self.direction - 1))
 
-    def tick(self, dt):
+    def tick(self, dt, leader=None):
         self.cross_time += dt
-        self.v = (self.v[0] + self.a[0] * dt, self.v[1] + self.a[1] * dt)
+        if self.a[0] or self.a[1]:
+            self.v = (self.v[0] + self.a[0] * dt, self.v[1] + self.a[1] * dt)
         self.pos = (self.pos[0] + self.v[0] * dt, self.pos[1] + self.v[1] * dt)
         near = 0.5
 
         if self.direction is True:
-            try:
-                near = min(p.pos[1] - (self.pos[1] + self.l) for p in self.game.pedestrians
-                           if p.direction and (self.pos[1] + self.l < p.pos[1]))
-            except ValueError:
-                pass
+            if leader is not None and self.pos[1] + self.l < leader.pos[1]:
+                near = leader.pos[1] - (self.pos[1] + self.l)
 
             if self.pos[1] + self.l < 0 and self.traffic.state != TrafficState.red:
                 near = min(-self.pos[1] - self.l, near)
         else:
-            try:
-                near = min(self.pos[1] - (p.pos[1] + p.l) for p in self.game.pedestrians
-                           if not p.direction and (self.pos[1] > p.pos[1] + p.l))
-            except ValueError:
-                pass
+            if leader is not None and self.pos[1] > leader.pos[1] + leader.l:
+                near = self.pos[1] - (leader.pos[1] + leader.l)
 
             if self.pos[1] > self.game.road_width and self.traffic.state != TrafficState.red:
                 near = min(self.pos[1] - self.game.road_width, near)
@@ -143,10 +214,12 @@ class Pedestrian:
 
 
 class Game:
-    def __init__(self, max_time, gui=True):
+    def __init__(self, max_time, gui=True, seed=None, arrivals_dt=None, profile=False):
         self.traffic_light = TrafficLight()
-        self.cars = []
-        self.pedestrians = []
+        self.car_lanes = {True: Lane(), False: Lane()}
+        self.pedestrian_lanes = {True: Lane(), False: Lane()}
+        # entities that left the scene, reused by later spawns and episodes
+        self.free = {Car: [], Pedestrian: []}
 
         self.road_width = 7
         self.road_segment = 25
@@ -157,11 +230,12 @@ class Game:
         self.outputs = [0 for _ in range(13)]
         self.sensors = (1, 3, 7, 13, 21)
 
-        self.gen_possibilities = [(1 / 14, 1 / 3), (1 / 3, 1 / 20), (1 / 30, 1 / 90), (1 / 3, 1 / 5)]
-        random.shuffle(self.gen_possibilities)
+        self.random = random.Random()
+        self.seed(seed)
 
         self.max_time = max_time
         self.sim_time = 0
+        self.ticks = 0
         self.red_time = 0
         self.green_time = 0
         self.switch_time = 0
@@ -174,111 +248,236 @@ class Game:
 
         self.go = False
         self.fitness = 0
+        # physics steps run by step() in this episode and the wall time they took
+        self.substeps = 0
+        self.substep_time = 0
+        # phase timings, collected only when profiling
+        self.perf = PerfCounters() if profile else None
+        # receive every tick once attached, see recorder.py and telemetry.py
+        self.recorder = None
+        self.telemetry = None
+
+        # arrivals drawn ahead for the whole episode, ticks must then be arrivals_dt long
+        self.arrivals_dt = arrivals_dt
+        self.arrivals = None
+        self.next_arrival = None
+        if arrivals_dt is not None:
+            self.sample_arrivals()
 
         self.gui = gui
-
+        # set once the window is closed, the owner of the loop decides how to stop
+        self.closed = False
+        # pygame is only imported for a window, headless games start without it
+        self.window = None
         if not self.gui:
             return
 
-        pygame.init()
-        self.size = self.width, self.height = 1200, 550
-        self.black = 0, 0, 0
-        self.white = 255, 255, 255
-        self.blue = 0, 0, 255
-        self.green = 128, 255, 128
-        self.red = 255, 0, 0
-        self.violet = 255, 0, 255
-        self.yellow = 255, 255, 0
-        self.pink = 252, 15, 192
-
-        self.screen = pygame.display.set_mode(self.size)
-        self.font = pygame.font.SysFont('Tahoma', 12, False, False)
-
-        self.zoom = 17
+        from window import Window
+        self.window = Window(self)
 
-        self.cam_pos_X = self.width / 2 - self.zebra_width * self.zoom / 2
-        self.cam_pos_Y = 300
+    def seed(self, seed):
+        self.random.seed(seed)
+        self.gen_possibilities = [(1 / 14, 1 / 3), (1 / 3, 1 / 20), (1 / 30, 1 / 90), (1 / 3, 1 / 5)]
+        self.random.shuffle(self.gen_possibilities)
+
+    def gap(self, possibility):
+        # ticks up to and including the next success of a Bernoulli trial per tick
+        if possibility >= 1:
+            return 1
+        if possibility <= 0:
+            return inf
+        return 1 + floor(log(1 - self.random.random()) / log(1 - possibility))
+
+    def sample_arrivals(self):
+        dt = self.arrivals_dt
+        period = int(self.max_time / 4)
+        # first tick of every traffic phase, summing sim_time the way tick does
+        parts = []
+        sim_time = 0
+        ticks = 0
+        while sim_time <= self.max_time:
+            part = int(sim_time / period)
+            if not parts or parts[-1][0] != part:
+                parts.append((part, ticks))
+            sim_time += dt
+            ticks += 1
+        parts.append((None, ticks))
+
+        self.arrivals = {}
+        self.next_arrival = {}
+        for kind, column in (("cars", 0), ("pedestrians", 1)):
+            for direction in (True, False):
+                schedule = array("l")
+                for (part, start), (_, end) in zip(parts, parts[1:]):
+                    possibility = dt * self.gen_possibilities[part][column]
+                    tick = start - 1 + self.gap(possibility)
+                    while tick < end:
+                        schedule.append(tick)
+                        tick += self.gap(possibility)
+                self.arrivals[kind, direction] = schedule
+                self.next_arrival[kind, direction] = 0
 
     @property
     def current_part(self):
         return int(self.sim_time / int(self.max_time / 4))
 
-    def recycling_cars(self, dt):
-        live_cars = []
-        for car in self.cars:
-            if (car.direction is True and car.pos[0] < self.zebra_width + self.road_segment) \
-                    or (car.direction is False and car.pos[0] + car.w > -self.road_segment):
-                live_cars.append(car)
-            else:
-                self.cars_crossed += 1
-                self.cars_wait += car.cross_time
+    @property
+    def cars(self):
+        return list(heapq.merge(self.car_lanes[True], self.car_lanes[False], key=attrgetter("serial")))
+
+    @property
+    def pedestrians(self):
+        return list(heapq.merge(self.pedestrian_lanes[True], self.pedestrian_lanes[False], key=attrgetter("serial")))
+
+    def entity(self, kind, pos, direction):
+        free = self.free[kind]
+        if not free:
+            return kind(pos, direction, self.traffic_light, self)
+        entity = free.pop()
+        entity.reset(pos, direction, self.traffic_light)
+        return entity
+
+    def release(self):
+        for lanes, kind in ((self.car_lanes, Car), (self.pedestrian_lanes, Pedestrian)):
+            for lane in lanes.values():
+                self.free[kind].extend(lane)
+
+    @staticmethod
+    def spawn(lanes, entity):
+        entity.serial = lanes[True].spawned + lanes[False].spawned
+        entity.before = lanes[not entity.direction].spawned
+        lanes[entity.direction].append(entity)
+
+    def spawn_edge(self, lanes, direction, axis, jitter, value):
+        # Spawn placement used to draw one random number per entity of both lanes in spawn order. Only the
+        # rear entities closer than the jitter to the last one can win the min/max, so draw just their numbers
+        # and skip the rest, keeping the generator in step with the full scan.
+        lane, other = lanes[direction], lanes[not direction]
+        candidates = []
+        for k, entity in enumerate(reversed(lane.queue)):
+            if candidates and abs(entity.pos[axis] - lane.rear.pos[axis]) > jitter:
+                break
+            candidates.append((len(lane) - 1 - k + max(0, entity.before - other.removed), entity))
+        candidates.sort(key=itemgetter(0))
+
+        values = []
+        drawn = 0
+        for index, entity in candidates:
+            skip_random(self.random, index - drawn)
+            values.append(value(entity, self.random.random()))
+            drawn = index + 1
+        skip_random(self.random, len(lane) + len(other) - drawn)
+        return values
+
+    def arrival(self, kind, direction, possibility):
+        if self.arrivals is None:
+            return self.random.random() < possibility
+        key = kind, direction
+        schedule, index = self.arrivals[key], self.next_arrival[key]
+        if index == len(schedule) or schedule[index] != self.ticks:
+            return False
+        self.next_arrival[key] = index + 1
+        return True
 
-        self.cars = live_cars
+    def recycling_cars(self, dt):
+        gone = []
+        lane = self.car_lanes[True]
+        while lane and not lane.front.pos[0] < self.zebra_width + self.road_segment:
+            gone.append(lane.pop_front())
+        lane = self.car_lanes[False]
+        while lane and not lane.front.pos[0] + lane.front.w > -self.road_segment:
+            gone.append(lane.pop_front())
+        for car in sorted(gone, key=attrgetter("serial")):
+            self.cars_crossed += 1
+            self.cars_wait += car.cross_time
+        self.free[Car].extend(gone)
 
         appear_possibility = (dt * self.gen_possibilities[self.current_part][0],
                               dt * self.gen_possibilities[self.current_part][0])
-        if random.random() < appear_possibility[0]:
-            if self.cars:
-                left = min(min((car.pos[0] - 0.5 - random.random() * 5) * car.direction for car in self.cars),
-                           -self.road_segment)
-            else:
-                left = -self.road_segment
-            self.cars.append(Car((left - 4, self.road_width / 2 + (self.road_width / 2 - 2) / 2), True,
-                                 self.traffic_light, self))
-        if random.random() < appear_possibility[1]:
-            if self.cars:
-                right = max(
-                    max((car.pos[0] + car.w + 0.5 + random.random() * 5) * (not car.direction) for car in self.cars),
-                    self.zebra_width + self.road_segment)
-            else:
-                right = self.zebra_width + self.road_segment
-            self.cars.append(Car((right, (self.road_width / 2 - 2) / 2), False, self.traffic_light, self))
+        if self.arrival("cars", True, appear_possibility[0]):
+            left = min(self.spawn_edge(self.car_lanes, True, 0, 5, lambda car, r: car.pos[0] - 0.5 - r * 5) +
+                       [-self.road_segment])
+            self.spawn(self.car_lanes, self.entity(Car, (left - 4, self.road_width / 2 + (self.road_width / 2 - 2) / 2),
+                                                   True))
+        if self.arrival("cars", False, appear_possibility[1]):
+            right = max(self.spawn_edge(self.car_lanes, False, 0, 5,
+                                        lambda car, r: car.pos[0] + car.w + 0.5 + r * 5) +
+                        [self.zebra_width + self.road_segment])
+            self.spawn(self.car_lanes, self.entity(Car, (right, (self.road_width / 2 - 2) / 2), False))
 
     def recycling_pedestrians(self, dt):
-        live_peds = []
-        for p in self.pedestrians:
-            if (p.direction is True and p.pos[1] < self.road_width + 2 * self.zebra_width) \
-                    or (p.direction is False and p.pos[1] + p.l > -2 * self.zebra_width):
-                live_peds.append(p)
-            else:
-                self.peds_crossed += 1
-                self.peds_wait += p.cross_time
-
-        self.pedestrians = live_peds
+        gone = []
+        lane = self.pedestrian_lanes[True]
+        while lane and not lane.front.pos[1] < self.road_width + 2 * self.zebra_width:
+            gone.append(lane.pop_front())
+        lane = self.pedestrian_lanes[False]
+        while lane and not lane.front.pos[1] + lane.front.l > -2 * self.zebra_width:
+            gone.append(lane.pop_front())
+        for p in sorted(gone, key=attrgetter("serial")):
+            self.peds_crossed += 1
+            self.peds_wait += p.cross_time
+        self.free[Pedestrian].extend(gone)
 
         appear_possibility = (dt * self.gen_possibilities[self.current_part][1],
                               dt * self.gen_possibilities[self.current_part][1])
-        if random.random() < appear_possibility[0]:
-            if self.pedestrians:
-                up = min(min((p.pos[1] - 0.1 - random.random() * 0.4) * p.direction for p in self.pedestrians),
-                         -self.zebra_width * 2)
-            else:
-                up = -self.zebra_width * 2
-            self.pedestrians.append(Pedestrian((self.zebra_width / 3, up - 0.5), True, self.traffic_light, self))
-        if random.random() < appear_possibility[1]:
-            if self.pedestrians:
-                down = max(
-                    max((p.pos[1] + p.l + 0.1 + random.random() * 0.4) * (not p.direction) for p in self.pedestrians),
-                    2 * self.zebra_width + self.road_width)
-            else:
-                down = 2 * self.zebra_width + self.road_width
-            self.pedestrians.append(Pedestrian((2 * self.zebra_width / 3, down), False, self.traffic_light, self))
+        if self.arrival("pedestrians", True, appear_possibility[0]):
+            up = min(self.spawn_edge(self.pedestrian_lanes, True, 1, 0.4, lambda p, r: p.pos[1] - 0.1 - r * 0.4) +
+                     [-self.zebra_width * 2])
+            self.spawn(self.pedestrian_lanes, self.entity(Pedestrian, (self.zebra_width / 3, up - 0.5), True))
+        if self.arrival("pedestrians", False, appear_possibility[1]):
+            down = max(self.spawn_edge(self.pedestrian_lanes, False, 1, 0.4,
+                                       lambda p, r: p.pos[1] + p.l + 0.1 + r * 0.4) +
+                       [2 * self.zebra_width + self.road_width])
+            self.spawn(self.pedestrian_lanes, self.entity(Pedestrian, (2 * self.zebra_width / 3, down), False))
 
     def tick(self, dt):
         if self.go:
             return
+        if self.perf is not None:
+            self.profiled_tick(dt)
+            return
 
         self.traffic_light.tick(dt)
-        for car in self.cars:
-            car.tick(dt)
-
-        for p in self.pedestrians:
-            p.tick(dt)
-
+        self.tick_lanes(self.car_lanes, dt)
+        self.tick_lanes(self.pedestrian_lanes, dt)
         self.recycling_cars(dt)
         self.recycling_pedestrians(dt)
-
+        self.update_fitness(dt)
+        if self.recorder is not None:
+            self.recorder.record(self)
+        if self.telemetry is not None:
+            self.telemetry.sample(self)
+
+    def profiled_tick(self, dt):
+        phases = (("light", self.traffic_light.tick, (dt,)), ("cars", self.tick_lanes, (self.car_lanes, dt)),
+                  ("pedestrians", self.tick_lanes, (self.pedestrian_lanes, dt)),
+                  ("recycling_cars", self.recycling_cars, (dt,)),
+                  ("recycling_pedestrians", self.recycling_pedestrians, (dt,)),
+                  ("fitness", self.update_fitness, (dt,)))
+        for name, phase, args in phases:
+            start = time.perf_counter()
+            phase(*args)
+            self.perf.add(name, start)
+        if self.recorder is not None:
+            start = time.perf_counter()
+            self.recorder.record(self)
+            self.perf.add("record", start)
+        if self.telemetry is not None:
+            start = time.perf_counter()
+            self.telemetry.sample(self)
+            self.perf.add("telemetry", start)
+
+    @staticmethod
+    def tick_lanes(lanes, dt):
+        for lane in lanes.values():
+            leader = None
+            for entity in lane:
+                entity.tick(dt, leader)
+                leader = entity
+
+    def update_fitness(self, dt):
         self.sim_time += dt
+        self.ticks += 1
         if self.traffic_light.state == TrafficState.green:
             self.green_time += dt
         elif self.traffic_light.state == TrafficState.red:
@@ -294,184 +493,176 @@ class Game:
                 self.fitness = 12216 * e ** (
                     -0.04 * (self.cars_wait + self.peds_wait) / (self.cars_crossed + self.peds_crossed))
             else:
-                live_cars_wait = sum(c.cross_time for c in self.cars)
-                live_peds_wait = sum(p.cross_time for p in self.pedestrians)
-                live_cars_count = len(self.cars)
-                live_peds_count = len(self.pedestrians)
+                # reached once per episode, summed in spawn order as before
+                cars, pedestrians = self.cars, self.pedestrians
+                live_cars_wait = sum(c.cross_time for c in cars)
+                live_peds_wait = sum(p.cross_time for p in pedestrians)
+                live_cars_count = len(cars)
+                live_peds_count = len(pedestrians)
                 self.fitness = 12216 * e ** (
                     -0.04 * (self.cars_wait + self.peds_wait + live_cars_wait + live_peds_wait) /
                     (self.cars_crossed + self.peds_crossed + live_cars_count + live_peds_count))
                 self.fitness /= 10
 
+    def fitness_bound(self):
+        # The fitness at the end is highest if the mean wait of the crossed entities is lowest. Every entity still
+        # on the scene or yet to arrive in time may cross at full speed at the earliest, counting those that would
+        # lower the mean the most is then the best case. A failure counts the entities on the scene at their
+        # current wait and ends no better. Without sampled arrivals any number of them may still come.
+        car_trip = (self.zebra_width + 2 * self.road_segment + 4) / 5
+        pedestrian_trip = self.road_width + 4 * self.zebra_width + 0.5
+        waits = []
+        for lane in self.car_lanes[True], self.car_lanes[False]:
+            for c in lane:
+                distance = self.zebra_width + self.road_segment - c.pos[0] if c.direction else \
+                    c.pos[0] + c.w + self.road_segment
+                waits.append(c.cross_time + max(0, distance) / 5)
+        for lane in self.pedestrian_lanes[True], self.pedestrian_lanes[False]:
+            for p in lane:
+                distance = self.road_width + 2 * self.zebra_width - p.pos[1] if p.direction else \
+                    p.pos[1] + p.l + 2 * self.zebra_width
+                waits.append(p.cross_time + max(0, distance))
+
+        future = []
+        for kind, trip in (("cars", car_trip), ("pedestrians", pedestrian_trip)):
+            count = 0
+            if self.arrivals is None:
+                count = inf
+            else:
+                for direction in (True, False):
+                    schedule = self.arrivals[kind, direction]
+                    last = (self.max_time + 1 - trip) / self.arrivals_dt
+                    count += max(0, bisect_right(schedule, last, self.next_arrival[kind, direction]) -
+                                 self.next_arrival[kind, direction])
+            future.append((trip, count))
+
+        crossed = self.cars_crossed + self.peds_crossed
+        total = self.cars_wait + self.peds_wait
+        for wait, count in sorted([(wait, 1) for wait in waits] + future):
+            if crossed and wait >= total / crossed:
+                break
+            if not count:
+                continue
+            if count == inf:
+                return 12216 * e ** (-0.04 * wait)
+            crossed += count
+            total += wait * count
+        if not crossed:
+            return 12216
+        return 12216 * e ** (-0.04 * total / crossed)
+
     def is_fail(self):
-        return any(True for p in self.pedestrians if p.cross_time > 90) or \
-               any(True for c in self.cars if c.cross_time > 120)
-
-    def draw_zebra(self):
-        number_of_lines = 7
-        width_of_line = self.road_width * self.zoom / (2 * number_of_lines)
-
-        pygame.draw.line(self.screen, self.green, [-self.road_segment * self.zoom + self.cam_pos_X, self.cam_pos_Y],
-                         [(self.road_segment + self.zebra_width) * self.zoom + self.cam_pos_X, self.cam_pos_Y], 2)
-        pygame.draw.line(self.screen, self.green, [-self.road_segment * self.zoom + self.cam_pos_X,
-                                                   self.cam_pos_Y + self.road_width * self.zoom],
-                         [(self.road_segment + self.zebra_width) * self.zoom + self.cam_pos_X,
-                          self.cam_pos_Y + self.road_width * self.zoom], 2)
-        pygame.draw.line(self.screen, self.green, [-self.road_segment * self.zoom + self.cam_pos_X,
-                                                   self.cam_pos_Y + self.road_width * self.zoom / 2],
-                         [(self.road_segment + self.zebra_width) * self.zoom + self.cam_pos_X,
-                          self.cam_pos_Y + self.road_width * self.zoom / 2], 1)
-
-        for i in range(number_of_lines):
-            pygame.draw.rect(self.screen, self.green, [self.cam_pos_X, self.cam_pos_Y + width_of_line * 2 * i,
-                                                       self.zebra_width * self.zoom, width_of_line])
-
-        pygame.draw.rect(self.screen, self.green, [self.cam_pos_X, self.cam_pos_Y,
-                                                   self.zebra_width * self.zoom, -self.zebra_width * self.zoom], 2)
-        pygame.draw.rect(self.screen, self.green,
-                         [self.cam_pos_X, self.cam_pos_Y + (width_of_line * 2 * number_of_lines),
-                          self.zebra_width * self.zoom, self.zebra_width * self.zoom], 2)
-
-    def draw_traffic_light(self):
-        state = self.traffic_light.state
-        light_states = [(True, False, False), (True, True, False), (False, False, True), (False, True, False)]
-        red_light, yellow_light, green_light = light_states[state.value]
-        traffic_light_pos_x = self.zebra_width * self.zoom + self.cam_pos_X
-        traffic_light_pos_y = self.cam_pos_Y
-        traffic_light_w = self.zebra_width / 3 * self.zoom
-        traffic_light_h = -self.zebra_width * self.zoom
-        pygame.draw.rect(self.screen, self.violet,
-                         [traffic_light_pos_x, traffic_light_pos_y, traffic_light_w, traffic_light_h], 3)
-        pygame.draw.circle(self.screen, self.red,
-                           [int(traffic_light_pos_x + 1 / 2 * traffic_light_w),
-                            int(traffic_light_pos_y + 5 / 6 * traffic_light_h)], int(traffic_light_w / 2),
-                           not red_light)
-        pygame.draw.circle(self.screen, self.yellow,
-                           [int(traffic_light_pos_x + 1 / 2 * traffic_light_w),
-                            int(traffic_light_pos_y + 3 / 6 * traffic_light_h)], int(traffic_light_w / 2),
-                           not yellow_light)
-        pygame.draw.circle(self.screen, self.green,
-                           [int(traffic_light_pos_x + 1 / 2 * traffic_light_w),
-                            int(traffic_light_pos_y + 1 / 6 * traffic_light_h)], int(traffic_light_w / 2),
-                           not green_light)
-
-    def draw_lamp(self, position, text, color, val):
-        _text = self.font.render(text, True, self.white)
-        self.screen.blit(_text, (position[0] + 10, position[1]))
-
-        pygame.draw.circle(self.screen, (128, 128, 128), (position[0], position[1] + 7), 5, 1)
-
-        if val:
-            pygame.draw.circle(self.screen, color, (position[0], position[1] + 7), 4, 0)
-
-    def draw_bar(self, rect, color, val):
-        pygame.draw.rect(self.screen, (128, 128, 128), ((rect[0][0], rect[0][1]), (rect[1][0], rect[1][1])), 1)
-        if val:
-            pygame.draw.rect(self.screen, color,
-                             ((rect[0][0] + 1, rect[0][1] + rect[1][1] - 2), (rect[1][0] - 2, -val * (rect[1][1] - 4))))
+        # everyone in a lane gets the same cross_time increments, so the front, spawned first, waits the longest
+        return any(lane.front.cross_time > 90 for lane in self.pedestrian_lanes.values() if lane) or \
+               any(lane.front.cross_time > 120 for lane in self.car_lanes.values() if lane)
 
     def draw(self):
-        if not self.gui:
+        if self.window is None:
             return
-        self.screen.fill(self.black)
-        self.draw_zebra()
-        self.draw_traffic_light()
-        for s in self.sensors:
-            pygame.draw.line(self.screen, self.white,
-                             [self.cam_pos_X + (self.zebra_width + s) * self.zoom, self.cam_pos_Y], [
-                                 self.cam_pos_X + (self.zebra_width + s) * self.zoom,
-                                 self.cam_pos_Y + (self.road_width / 2) * self.zoom])
-            pygame.draw.line(self.screen, self.white,
-                             [self.cam_pos_X - s * self.zoom, self.cam_pos_Y + self.road_width * self.zoom],
-                             [self.cam_pos_X - s * self.zoom, self.cam_pos_Y + self.road_width / 2 * self.zoom])
-        for car in self.cars:
-            pygame.draw.rect(self.screen, self.red,
-                             [car.pos[0] * self.zoom + self.cam_pos_X, car.pos[1] * self.zoom + self.cam_pos_Y,
-                              car.w * self.zoom, car.h * self.zoom], 2)
-
-        for p in self.pedestrians:
-            pygame.draw.rect(self.screen, self.pink,
-                             [p.pos[0] * self.zoom + self.cam_pos_X, p.pos[1] * self.zoom + self.cam_pos_Y,
-                              p.l * self.zoom, p.l * self.zoom])
-
-        self.draw_bar(((50, 10), (10, 50)), (40, 235, 40), self.inputs[0])
-
-        self.draw_bar(((100, 10), (10, 50)), (235, 40, 40), self.outputs[0])
-        self.draw_bar(((115, 10), (10, 50)), (40, 40, 235), self.outputs[1])
-        self.draw_bar(((130, 10), (10, 50)), (40, 40, 235), self.outputs[2])
-        for i in range(3, len(self.outputs)):
-            self.draw_bar(((100 + i * 15, 10), (10, 50)), self.white, self.outputs[i])
-
-        if self.sim_time:
-            self.draw_bar(((500, 10), (10, 50)), (235, 40, 40), self.red_time / self.sim_time)
-            self.draw_bar(((515, 10), (10, 50)), (40, 235, 40), self.green_time / self.sim_time)
-            self.draw_bar(((530, 10), (10, 50)), (235, 235, 40), self.switch_time / self.sim_time)
-
-        self.screen.blit(self.font.render("Simulation time:  {:.0f}s".format(self.sim_time), True, self.white),
-                         (650, 10))
-        self.screen.blit(self.font.render("Cars crossed:  {}".format(self.cars_crossed), True, self.white),
-                         (650, 30))
-        self.screen.blit(self.font.render("Peds crossed: {}".format(self.peds_crossed), True, self.white),
-                         (650, 50))
-        if self.cars_crossed:
-            self.screen.blit(self.font.render("Cars wait:  {:3.1f}s".format(self.cars_wait / self.cars_crossed),
-                                              True, self.white), (650, 70))
-        if self.peds_crossed:
-            self.screen.blit(self.font.render("Peds wait: {:3.1f}s".format(self.peds_wait / self.peds_crossed),
-                                              True, self.white), (650, 90))
-
-        self.screen.blit(self.font.render("Fitness: {:6.0f}".format(self.fitness),
-                                          True, self.white), (650, 110))
-
-        pygame.display.flip()
+        start = time.perf_counter()
+        self.window.draw()
+        if self.perf is not None:
+            self.perf.add("draw", start)
 
     def get(self):
+        start = time.perf_counter()
         outputs = []
         state_mappings = (1, 1, 0, 0)
         outputs.append(state_mappings[self.traffic_light.state.value])
 
-        up_sensor = any(True for p in self.pedestrians if
-                        0 < p.pos[0] < self.zebra_width and -self.zebra_width < p.pos[1] < 0)
-        down_sensor = any(True for p in self.pedestrians if
-                          0 < p.pos[0] < self.zebra_width and
-                          self.road_width < p.pos[1] < self.road_width + self.zebra_width)
+        up_sensor = self.zone_sensor(-self.zebra_width, 0)
+        down_sensor = self.zone_sensor(self.road_width, self.road_width + self.zebra_width)
         outputs.append(up_sensor)
         outputs.append(down_sensor)
 
-        for s in self.sensors:
-            val = any(True for c in self.cars if c.direction and c.pos[0] < -s < c.pos[0] + c.w)
-            outputs.append(val)
-        for s in self.sensors:
-            val = any(True for c in self.cars if not c.direction and c.pos[0] < s + self.zebra_width < c.pos[0] + c.w)
-            outputs.append(val)
+        outputs.extend(self.line_sensors(True, [-s for s in self.sensors]))
+        outputs.extend(self.line_sensors(False, [s + self.zebra_width for s in self.sensors]))
 
         self.outputs = [int(out) for out in outputs]
+        if self.perf is not None:
+            self.perf.add("get", start)
         return self.outputs
 
+    def zone_sensor(self, low, high):
+        # nobody overtakes inside a lane, so a walk from the front only passes the few pedestrians already beyond
+        # the zone, which leave the scene soon after, and stops at the first one behind it
+        for direction, lane in self.pedestrian_lanes.items():
+            for p in lane:
+                if (p.pos[1] <= low) if direction else (p.pos[1] >= high):
+                    break
+                if low < p.pos[1] < high and 0 < p.pos[0] < self.zebra_width:
+                    return True
+        return False
+
+    def line_sensors(self, direction, lines):
+        values = [False] * len(lines)
+        near, far = (max(lines), min(lines)) if direction else (min(lines), max(lines))
+        for c in self.car_lanes[direction]:
+            rear, front = c.pos[0], c.pos[0] + c.w
+            if direction:
+                if rear >= near:
+                    continue
+                if front <= far:
+                    break
+            else:
+                if front <= near:
+                    continue
+                if rear >= far:
+                    break
+            for k, line in enumerate(lines):
+                if rear < line < front:
+                    values[k] = True
+        return values
+
     def set(self, inputs):
         self.inputs = inputs
         self.traffic_light.control_sig = inputs[0] > 0.5
 
+    def step(self, inputs, substeps=1, dt=1 / 15, aggregate="last"):
+        # one controller decision held for several physics steps, sensors of the skipped frames are either dropped
+        # ("last") or or-ed into the observation ("any" or "max", the same for the 0/1 outputs)
+        if aggregate not in ("last", "any", "max"):
+            raise ValueError("unknown aggregate {}".format(aggregate))
+        self.set(inputs)
+        observation = None
+        start = time.perf_counter()
+        for _ in range(substeps):
+            self.tick(dt)
+            if aggregate != "last":
+                outputs = self.get()
+                observation = outputs if observation is None else [max(a, b) for a, b in zip(observation, outputs)]
+        self.substeps += substeps
+        self.substep_time += time.perf_counter() - start
+        return self.get() if observation is None else observation
+
+    def perf_stats(self, reset=False):
+        stats = {"phases": self.perf.stats() if self.perf is not None else {}, "ticks": self.ticks,
+                 "sim_time": self.sim_time,
+                 "cars": len(self.car_lanes[True]) + len(self.car_lanes[False]),
+                 "pedestrians": len(self.pedestrian_lanes[True]) + len(self.pedestrian_lanes[False])}
+        if reset and self.perf is not None:
+            self.perf.reset()
+        return stats
+
     def dispatch_messages(self):
-        if not self.gui:
-            return
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                sys.exit()
-            if event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_RETURN:
-                    self.restart()
-
-    def restart(self):
+        if self.window is not None:
+            self.window.dispatch_messages()
+
+    def restart(self, seed=None):
+        if seed is not None:
+            self.seed(seed)
+
+        self.release()
         self.traffic_light = TrafficLight()
-        self.cars = []
-        self.pedestrians = []
+        self.car_lanes = {True: Lane(), False: Lane()}
+        self.pedestrian_lanes = {True: Lane(), False: Lane()}
 
         self.inputs = [0]
         self.outputs = [0, 0, 0]
         self.sensors = [1, 3, 7, 13, 21]
 
         self.sim_time = 0
+        self.ticks = 0
         self.red_time = 0
         self.green_time = 0
         self.switch_time = 0
@@ -484,6 +675,75 @@ class Game:
 
         self.go = False
         self.fitness = 0
+        self.substeps = 0
+        self.substep_time = 0
+
+        if self.arrivals_dt is not None:
+            self.sample_arrivals()
+        if self.recorder is not None:
+            self.recorder.restart()
+        if self.telemetry is not None:
+            self.telemetry.restart()
+
+    def snapshot(self):
+        light = self.traffic_light
+        lanes = tuple((lane.spawned, tuple((entity.pos, entity.v, entity.a, entity.cross_time, entity.serial,
+                                            entity.before) for entity in lane))
+                      for lanes in (self.car_lanes, self.pedestrian_lanes) for lane in lanes.values())
+        counters = (self.sim_time, self.ticks, self.red_time, self.green_time, self.switch_time, self.cars_crossed,
+                    self.peds_crossed, self.cars_wait, self.peds_wait, self.go, self.fitness)
+        # sampled arrival arrays are never written to and are shared between snapshots
+        arrivals = self.arrivals, self.next_arrival and tuple(self.next_arrival.items())
+        # the phase lengths of the light and the sensor lines may be set per scenario, see pool.configure
+        return ((light.state, light.state_time, light.control_sig, tuple(light.state_time_min)), lanes, counters,
+                tuple(self.inputs), tuple(self.outputs), self.random.getstate(), tuple(self.gen_possibilities),
+                arrivals, tuple(self.sensors))
+
+    def restore(self, state):
+        light_state, lanes, counters, inputs, outputs, random_state, gen_possibilities, arrivals, sensors = state
+
+        self.traffic_light = TrafficLight()
+        light = self.traffic_light
+        light.state, light.state_time, light.control_sig, state_time_min = light_state
+        light.state_time_min = list(state_time_min)
+
+        self.release()
+        self.car_lanes = {True: Lane(), False: Lane()}
+        self.pedestrian_lanes = {True: Lane(), False: Lane()}
+        targets = ((self.car_lanes, True, Car), (self.car_lanes, False, Car),
+                   (self.pedestrian_lanes, True, Pedestrian), (self.pedestrian_lanes, False, Pedestrian))
+        for (target, direction, kind), (spawned, entities) in zip(targets, lanes):
+            lane = target[direction]
+            for pos, v, a, cross_time, serial, before in entities:
+                entity = self.entity(kind, pos, direction)
+                entity.v, entity.a, entity.cross_time, entity.serial, entity.before = v, a, cross_time, serial, before
+                lane.queue.append(entity)
+            lane.spawned = spawned
+
+        (self.sim_time, self.ticks, self.red_time, self.green_time, self.switch_time, self.cars_crossed,
+         self.peds_crossed, self.cars_wait, self.peds_wait, self.go, self.fitness) = counters
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.random.setstate(random_state)
+        self.gen_possibilities = list(gen_possibilities)
+        self.arrivals, next_arrival = arrivals
+        self.next_arrival = next_arrival and dict(next_arrival)
+        self.sensors = list(sensors)
+
+    def clone(self):
+        # a shallow copy keeps the configuration, restore replaces every piece of mutable state
+        game = copy.copy(self)
+        game.gui = False
+        game.window = None
+        game.perf = None
+        game.recorder = None
+        game.telemetry = None
+        game.random = random.Random(0)
+        game.car_lanes = {True: Lane(), False: Lane()}
+        game.pedestrian_lanes = {True: Lane(), False: Lane()}
+        game.free = {Car: [], Pedestrian: []}
+        game.restore(self.snapshot())
+        return game
 
 
 def main():
@@ -492,7 +752,7 @@ def main():
     # time_old = time.perf_counter()
     time_draw = time.perf_counter()
     light_timer = 0
-    while True:
+    while not game.closed:
         game.tick(1 / 15)
         game.get()
         #time.sleep(1 / 6000)
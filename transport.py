@@ -0,0 +1,138 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import pynlab
+except ImportError:
+    pynlab = None
+
+from common import rule
+from wire import OUTCOUNT, PACKED_INCOUNT, PLAIN_INCOUNT, pack_observation, pack_observations, unpack_observations
+
+__author__ = "leon.ljsh"
+
+
+class Transport:
+    """Exchange of observations and actions between a group of environments and their controller
+
+    `exchange` returns None and `restart` returns False once the controller asks to stop.
+    """
+
+    async def open(self, count):
+        pass
+
+    async def exchange(self, observations):
+        raise NotImplementedError
+
+    async def restart(self, fitness):
+        return True
+
+    def close(self):
+        pass
+
+
+class NLabTransport(Transport):
+    """Session with an nlab server, its blocking calls run on a thread of their own so other groups keep stepping
+
+    A packed session asks for one input per environment, the observation as a bit mask, and falls back to the plain
+    format if the start information of the server disagrees. Only the input count is negotiated, so the actions
+    stay the usual outputs from 0 to 1 either way.
+    """
+
+    def __init__(self, uri, packed=False):
+        # only a session with nlab needs pynlab, the loopback runs without it
+        if pynlab is None:
+            raise ImportError("pynlab is required to connect to nlab at {}, install it or use --loopback".format(uri))
+        self.uri = uri
+        self.packed = packed
+        self.lab = pynlab.NLab(uri)
+        self.executor = ThreadPoolExecutor(1)
+
+    def call(self, function, *args):
+        return asyncio.get_event_loop().run_in_executor(self.executor, function, *args)
+
+    async def open(self, count):
+        esi = pynlab.EStartInfo()
+        esi.count = count
+        esi.incount = PACKED_INCOUNT if self.packed else PLAIN_INCOUNT
+        esi.outcount = OUTCOUNT
+        esi.mode = pynlab.SendModes.specified
+
+        await self.call(self.lab.connect)
+        print("connected to nlab at {}, waiting for start information".format(self.uri))
+        await self.call(self.lab.set_start_info, esi)
+        info = await self.call(self.lab.get_start_info)
+        if self.packed and getattr(info, "incount", PACKED_INCOUNT) != PACKED_INCOUNT:
+            print("nlab expects {} inputs, sending plain observations".format(info.incount))
+            self.packed = False
+
+    def request(self, esdi):
+        self.lab.set(esdi)
+        return self.lab.get()
+
+    async def exchange(self, observations):
+        esdi = pynlab.ESendInfo()
+        esdi.head = pynlab.VerificationHeader.ok
+        esdi.data = [[pack_observation(o)] for o in observations] if self.packed else observations
+        get = await self.call(self.request, esdi)
+        if self.lab.is_ok == pynlab.VerificationHeader.stop:
+            return None
+        return get.data
+
+    def restart_session(self, eri):
+        self.lab.restart(eri)
+        self.lab.get()
+
+    async def restart(self, fitness):
+        eri = pynlab.ERestartInfo()
+        eri.result = fitness
+        await self.call(self.restart_session, eri)
+        return self.lab.is_ok != pynlab.VerificationHeader.stop
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+class LoopbackTransport(Transport):
+    """In-process controller for runs and measurements without an nlab server
+
+    Every exchange waits `latency` seconds of simulated round trip, the session stops after `episodes`. A packed
+    loopback sends the observations of every batch through the packed wire format like NLabTransport.
+    """
+
+    def __init__(self, episodes, controller=rule, latency=0, packed=False):
+        self.episodes = episodes
+        self.controller = controller
+        self.latency = latency
+        self.packed = packed
+
+    async def exchange(self, observations):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.packed:
+            observations = unpack_observations(pack_observations(observations))
+        return [self.controller(o) for o in observations]
+
+    async def restart(self, fitness):
+        self.episodes -= 1
+        return self.episodes > 0
+
+
+def main():
+    from main import run
+    from traffic_env import Game
+
+    # a group only waits for its own round trip, it pays off once stepping all environments takes about as long
+    for latency in (0, 0.002):
+        for groups in (1, 2, 4):
+            games = [Game(60, gui=False, seed=i) for i in range(32)]
+            start = time.perf_counter()
+            run([LoopbackTransport(1, latency=latency) for _ in range(groups)], games, verbose=False)
+            elapsed = time.perf_counter() - start
+            print("latency {:.0f}ms, {} groups: {:.0f} environment steps/s".format(
+                latency * 1e3, groups, sum(g.ticks for g in games) / elapsed))
+
+
+if __name__ == "__main__":
+    main()
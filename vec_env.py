@@ -0,0 +1,338 @@
+import time
+from math import e
+
+import numpy as np
+
+import common
+from traffic_env import Game, TrafficState
+
+__author__ = "leon.ljsh"
+
+RED, RED_GREEN, GREEN, GREEN_RED = (s.value for s in TrafficState)
+
+# next light state indexed by [state, control_sig], applied once the state has lasted its minimum time
+LIGHT_TRANSITIONS = np.array([[RED, RED_GREEN], [GREEN, GREEN], [GREEN_RED, GREEN], [RED, RED]])
+
+ENTITY_FIELDS = (("alive", bool, False), ("moving", bool, False), ("front", float, 0), ("born", float, 0),
+                 ("lane", np.intp, 0), ("instance", np.intp, 0), ("key", np.intp, 0), ("leader", np.intp, -1),
+                 ("follower", np.intp, -1), ("length", float, 0), ("speed", float, 0), ("near_stop", float, 0),
+                 ("near_start", float, 0), ("stop_line", float, 0))
+
+
+class VecGame:
+    """N independent intersections stepped together.
+
+    Entities of all instances share one pool of arrays, free slots are reused lowest first and per-tick work only
+    covers the pool up to the highest slot ever used. Lanes are cars right, cars left, pedestrians down and
+    pedestrians up; every entity links to its leader and follower in its lane, and positions are kept as the
+    coordinate of the entity front along its direction of motion, so all four lanes move towards larger values
+    and share the rules of Car.tick and Pedestrian.tick.
+    """
+
+    def __init__(self, n, max_time, seed=None, capacity=1024):
+        self.n = n
+        self.max_time = max_time
+        self.rng = np.random.default_rng(seed)
+
+        self.road_width = 7
+        self.road_segment = 25
+        self.zebra_width = 3
+        self.sensors = (1, 3, 7, 13, 21)
+        self.state_time_min = np.array([7, 6, 10, 3])
+
+        self.lane_sign = np.array([1, -1, 1, -1])
+        self.lane_is_car = np.array([True, True, False, False])
+        self.lane_length = np.array([4, 4, 0.5, 0.5])
+        self.lane_speed = np.array([5, 5, 1, 1])
+        self.lane_near_stop = np.array([0.5, 0.5, 0.1, 0.1])
+        self.lane_near_start = np.array([1.5, 1.5, 0.5, 0.5])
+        self.lane_stop_line = np.array([0, -self.zebra_width, 0, -self.road_width])
+        self.lane_exit_line = np.array([self.zebra_width + self.road_segment, self.road_segment,
+                                        self.road_width + 2 * self.zebra_width, 2 * self.zebra_width])
+        self.lane_spawn_line = np.array([-self.road_segment, -self.zebra_width - self.road_segment,
+                                         -2 * self.zebra_width, -2 * self.zebra_width - self.road_width])
+        self.lane_spawn_gap = np.array([0.5, 0.5, 0.1, 0.1])
+        self.lane_spawn_jitter = np.array([5, 5, 0.4, 0.4])
+        self.lane_max_cross_time = np.array([120, 120, 90, 90])[:, None]
+
+        # car sensor lines as front coordinates, ascending; cars going left meet them zebra_width further
+        self.sensor_lines = -np.array(self.sensors[::-1], dtype=float)
+        self.lane_sensor_offset = np.array([0, self.zebra_width, 0, 0])
+        self.lane_sensor_column = np.array([7, 12, 0, 0])
+
+        gen_possibilities = np.array([(1 / 14, 1 / 3), (1 / 3, 1 / 20), (1 / 30, 1 / 90), (1 / 3, 1 / 5)])
+        self.gen_possibilities = gen_possibilities[np.argsort(self.rng.random((n, 4)), axis=1)]
+
+        self.capacity = capacity
+        self.size = 0
+        for name, dtype, value in ENTITY_FIELDS:
+            setattr(self, name, np.full(capacity, value, dtype=dtype))
+
+        self.head = np.full((4, n), -1)
+        self.tail = np.full((4, n), -1)
+        self.count = np.zeros((4, n), dtype=int)
+
+        self.state = np.full(n, GREEN)
+        self.state_time = np.zeros(n)
+        self.control_sig = np.ones(n, dtype=bool)
+
+        self.inputs = np.zeros(n)
+        self.outputs = np.zeros((n, 13), dtype=np.uint8)
+
+        self.sim_time = np.zeros(n)
+        self.red_time = np.zeros(n)
+        self.green_time = np.zeros(n)
+        self.switch_time = np.zeros(n)
+
+        self.crossed = np.zeros((4, n), dtype=int)
+        self.wait = np.zeros((4, n))
+
+        self.go = np.zeros(n, dtype=bool)
+        self.fitness = np.zeros(n)
+
+    @property
+    def cars_crossed(self):
+        return self.crossed[0] + self.crossed[1]
+
+    @property
+    def peds_crossed(self):
+        return self.crossed[2] + self.crossed[3]
+
+    @property
+    def cars_wait(self):
+        return self.wait[0] + self.wait[1]
+
+    @property
+    def peds_wait(self):
+        return self.wait[2] + self.wait[3]
+
+    @property
+    def cross_time(self):
+        return self.sim_time[self.instance] - self.born
+
+    @property
+    def positions(self):
+        """Game-style coordinate of every entity along its axis (x for cars, y for pedestrians)"""
+        return np.where(self.lane_sign[self.lane] > 0, self.front - self.lane_length[self.lane], -self.front)
+
+    def grow(self):
+        for name, dtype, value in ENTITY_FIELDS:
+            field = np.full(2 * self.capacity, value, dtype=dtype)
+            field[:self.capacity] = getattr(self, name)
+            setattr(self, name, field)
+        self.capacity *= 2
+
+    def tick_light(self, dt, live):
+        self.state_time[live] += dt
+        over = live & (self.state_time > self.state_time_min[self.state])
+        new_state = np.where(over, LIGHT_TRANSITIONS[self.state, self.control_sig.astype(int)], self.state)
+        self.state_time[new_state != self.state] = 0
+        self.state = new_state
+
+    def tick_entities(self, dt, live):
+        size = self.size
+        front, leader, near_start = self.front[:size], self.leader[:size], self.near_start[:size]
+        # free slots may drift or change their flag, nothing reads them until a spawn overwrites them
+        moving = self.moving[:size]
+        if not live.all():
+            moving = moving & live[self.instance[:size]]
+        front += self.speed[:size] * dt * moving
+
+        gap = front[leader] - self.length[:size] - front
+        near = np.where((leader >= 0) & (gap > 0), gap, near_start)
+
+        blocked = np.where(self.lane_is_car[:, None], self.state != GREEN, self.state != RED)
+        line_gap = np.where(blocked.ravel()[self.key[:size]], self.stop_line[:size], np.inf) - front
+        np.minimum(near, np.where(line_gap > 0, line_gap, np.inf), out=near)
+
+        self.moving[:size] |= near >= near_start
+        self.moving[:size] &= near >= self.near_stop[:size]
+
+    def recycle(self, dt, live):
+        now = self.sim_time + dt
+        while True:
+            head = self.head
+            gone = live & (head >= 0) & (self.front[head] - self.lane_length[:, None] >= self.lane_exit_line[:, None])
+            if not gone.any():
+                break
+            lane, i = np.nonzero(gone)
+            first = head[lane, i]
+            follower = self.follower[first]
+            self.crossed[lane, i] += 1
+            self.wait[lane, i] += now[i] - self.born[first]
+            self.alive[first] = False
+            self.leader[follower[follower >= 0]] = -1
+            self.head[lane, i] = follower
+            self.tail[lane, i] = np.where(follower >= 0, self.tail[lane, i], -1)
+            self.count[lane, i] -= 1
+
+        part = np.minimum((self.sim_time / int(self.max_time / 4)).astype(int), 3)
+        rates = self.gen_possibilities[np.arange(self.n), part][:, [0, 0, 1, 1]].T
+        spawn = live & (self.rng.random((4, self.n)) < dt * rates)
+        if not spawn.any():
+            return
+
+        lane, i = np.nonzero(spawn)
+        rear = self.tail[lane, i]
+        edge = self.lane_spawn_line[lane]
+        # the rear entity and the one ahead of it are the only ones that can win the jittered placement
+        candidate = rear
+        for _ in range(2):
+            found = candidate >= 0
+            place = self.front[candidate] - self.lane_length[lane] - self.lane_spawn_gap[lane] - \
+                self.rng.random(len(lane)) * self.lane_spawn_jitter[lane]
+            edge = np.where(found, np.minimum(edge, place), edge)
+            candidate = np.where(found, self.leader[candidate], -1)
+
+        free = np.flatnonzero(~self.alive)
+        while len(free) < len(lane):
+            self.grow()
+            free = np.flatnonzero(~self.alive)
+        slot = free[:len(lane)]
+        self.size = max(self.size, slot[-1] + 1)
+
+        self.alive[slot] = True
+        self.moving[slot] = False
+        self.front[slot] = edge
+        self.born[slot] = now[i]
+        self.lane[slot] = lane
+        self.instance[slot] = i
+        self.key[slot] = lane * self.n + i
+        self.length[slot] = self.lane_length[lane]
+        self.speed[slot] = self.lane_speed[lane]
+        self.near_stop[slot] = self.lane_near_stop[lane]
+        self.near_start[slot] = self.lane_near_start[lane]
+        self.stop_line[slot] = self.lane_stop_line[lane]
+        self.leader[slot] = rear
+        self.follower[slot] = -1
+        self.follower[rear[rear >= 0]] = slot[rear >= 0]
+        self.head[lane, i] = np.where(rear >= 0, self.head[lane, i], slot)
+        self.tail[lane, i] = slot
+        self.count[lane, i] += 1
+
+    def tick(self, dt):
+        live = ~self.go
+        if not live.any():
+            return
+
+        self.tick_light(dt, live)
+        self.tick_entities(dt, live)
+        self.recycle(dt, live)
+
+        self.sim_time[live] += dt
+        self.green_time[live & (self.state == GREEN)] += dt
+        self.red_time[live & (self.state == RED)] += dt
+        self.switch_time[live & (self.state != GREEN) & (self.state != RED)] += dt
+
+        # entities of a lane enter in order and age together, so the front one has waited the longest
+        oldest = self.sim_time - self.born[self.head]
+        fail = ((self.head >= 0) & (oldest > self.lane_max_cross_time)).any(axis=0)
+        self.go |= live & (fail | (self.sim_time > self.max_time))
+
+        scored = live & (self.cars_crossed > 0) & (self.peds_crossed > 0)
+        crossed = self.cars_crossed + self.peds_crossed
+        wait = self.cars_wait + self.peds_wait
+        self.fitness = np.where(scored, 12216 * e ** (-0.04 * wait / np.maximum(crossed, 1)), self.fitness)
+        failed = scored & fail
+        if failed.any():
+            live_wait = np.bincount(self.instance, weights=np.where(self.alive, self.cross_time, 0), minlength=self.n)
+            live_count = self.count.sum(axis=0)
+            self.fitness[failed] = 12216 * e ** (
+                -0.04 * (wait + live_wait)[failed] / (crossed + live_count)[failed]) / 10
+
+    def get(self):
+        self.outputs[:] = 0
+        self.outputs[:, 0] = (self.state == RED) | (self.state == RED_GREEN)
+
+        alive = np.flatnonzero(self.alive[:self.size])
+        lane, instance, front = self.lane[alive], self.instance[alive], self.front[alive]
+        cars = lane < 2
+
+        # a car covers the sensor lines strictly between its back and front, two of them at most
+        lane_car, instance_car = lane[cars], instance[cars]
+        front_car = front[cars] + self.lane_sensor_offset[lane_car]
+        back = np.searchsorted(self.sensor_lines, front_car - self.lane_length[lane_car], side="right")
+        covered = np.searchsorted(self.sensor_lines, front_car, side="left") - back
+        column = self.lane_sensor_column[lane_car] - back
+        for extra in range(2):
+            over = covered > extra
+            self.outputs[instance_car[over], column[over] - extra] = 1
+
+        # pedestrians always walk inside the zebra horizontally, so only their y position matters
+        peds = ~cars
+        lane_ped, instance_ped = lane[peds], instance[peds]
+        y = np.where(lane_ped == 2, front[peds] - self.lane_length[2], -front[peds])
+        for column, low, high in ((1, -self.zebra_width, 0),
+                                  (2, self.road_width, self.road_width + self.zebra_width)):
+            waiting = (low < y) & (y < high)
+            self.outputs[instance_ped[waiting], column] = 1
+        return self.outputs
+
+    def set(self, inputs):
+        self.inputs = np.asarray(inputs, dtype=float).reshape(self.n)
+        self.control_sig = self.inputs > 0.5
+
+    def step(self, actions, dt=1 / 15):
+        self.set(actions)
+        self.tick(dt)
+        return self.get(), self.fitness.copy()
+
+    def restart(self, mask=None):
+        mask = np.ones(self.n, dtype=bool) if mask is None else np.asarray(mask, dtype=bool)
+        self.alive[mask[self.instance]] = False
+        if not self.alive.any():
+            self.size = 0
+        self.head[:, mask] = -1
+        self.tail[:, mask] = -1
+        self.count[:, mask] = 0
+
+        self.state[mask] = GREEN
+        self.state_time[mask] = 0
+        self.control_sig[mask] = True
+
+        self.inputs[mask] = 0
+        self.outputs[mask] = 0
+
+        for times in (self.sim_time, self.red_time, self.green_time, self.switch_time, self.fitness):
+            times[mask] = 0
+        self.crossed[:, mask] = 0
+        self.wait[:, mask] = 0
+        self.go[mask] = False
+
+
+def rule(outputs):
+    o = outputs.astype(bool)
+    return ~(o[:, 1] | o[:, 2]) | (o[:, 3] & o[:, 7]) | (o[:, 12] & o[:, 8])
+
+
+def main():
+    n, max_time = 512, 600
+    print("stepping intersections for {}s each...".format(max_time))
+
+    games = [Game(max_time, gui=False) for _ in range(32)]
+    steps = 0
+    start = time.perf_counter()
+    while not all(game.go for game in games):
+        for game in games:
+            if game.go:
+                continue
+            game.set(common.rule(game.get()))
+            game.tick(1 / 15)
+            steps += 1
+    elapsed = time.perf_counter() - start
+    print("Game:    {:10.0f} steps/s, mean fitness {:6.0f}".format(steps / elapsed,
+                                                                   sum(g.fitness for g in games) / len(games)))
+
+    vec = VecGame(n, max_time)
+    steps = 0
+    start = time.perf_counter()
+    outputs = vec.get()
+    while not vec.go.all():
+        steps += (~vec.go).sum()
+        outputs, fitness = vec.step(rule(outputs))
+    elapsed = time.perf_counter() - start
+    print("VecGame: {:10.0f} steps/s, mean fitness {:6.0f}".format(steps / elapsed, vec.fitness.mean()))
+
+
+if __name__ == "__main__":
+    main()
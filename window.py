@@ -0,0 +1,179 @@
+import pygame
+
+__author__ = "leon.ljsh"
+
+
+class Window:
+    """pygame window of a Game, only imported once a game is created with a gui
+
+    The static scene and rendered labels are kept between frames, only the changed areas are redrawn.
+    """
+
+    def __init__(self, game):
+        self.game = game
+        pygame.init()
+        self.size = self.width, self.height = 1200, 550
+        self.black = 0, 0, 0
+        self.white = 255, 255, 255
+        self.blue = 0, 0, 255
+        self.green = 128, 255, 128
+        self.red = 255, 0, 0
+        self.violet = 255, 0, 255
+        self.yellow = 255, 255, 0
+        self.pink = 252, 15, 192
+
+        self.screen = pygame.display.set_mode(self.size)
+        self.font = pygame.font.SysFont('Tahoma', 12, False, False)
+        self.background = None
+        self.background_sensors = None
+        self.texts = {}
+        self.dirty = []
+
+        self.zoom = 17
+
+        self.cam_pos_X = self.width / 2 - game.zebra_width * self.zoom / 2
+        self.cam_pos_Y = 300
+
+    def draw_zebra(self, surface):
+        game = self.game
+        number_of_lines = 7
+        width_of_line = game.road_width * self.zoom / (2 * number_of_lines)
+
+        pygame.draw.line(surface, self.green, [-game.road_segment * self.zoom + self.cam_pos_X, self.cam_pos_Y],
+                         [(game.road_segment + game.zebra_width) * self.zoom + self.cam_pos_X, self.cam_pos_Y], 2)
+        pygame.draw.line(surface, self.green, [-game.road_segment * self.zoom + self.cam_pos_X,
+                                               self.cam_pos_Y + game.road_width * self.zoom],
+                         [(game.road_segment + game.zebra_width) * self.zoom + self.cam_pos_X,
+                          self.cam_pos_Y + game.road_width * self.zoom], 2)
+        pygame.draw.line(surface, self.green, [-game.road_segment * self.zoom + self.cam_pos_X,
+                                               self.cam_pos_Y + game.road_width * self.zoom / 2],
+                         [(game.road_segment + game.zebra_width) * self.zoom + self.cam_pos_X,
+                          self.cam_pos_Y + game.road_width * self.zoom / 2], 1)
+
+        for i in range(number_of_lines):
+            pygame.draw.rect(surface, self.green, [self.cam_pos_X, self.cam_pos_Y + width_of_line * 2 * i,
+                                                   game.zebra_width * self.zoom, width_of_line])
+
+        pygame.draw.rect(surface, self.green, [self.cam_pos_X, self.cam_pos_Y,
+                                               game.zebra_width * self.zoom, -game.zebra_width * self.zoom], 2)
+        pygame.draw.rect(surface, self.green,
+                         [self.cam_pos_X, self.cam_pos_Y + (width_of_line * 2 * number_of_lines),
+                          game.zebra_width * self.zoom, game.zebra_width * self.zoom], 2)
+
+    def draw_traffic_light(self):
+        game = self.game
+        state = game.traffic_light.state
+        light_states = [(True, False, False), (True, True, False), (False, False, True), (False, True, False)]
+        red_light, yellow_light, green_light = light_states[state.value]
+        traffic_light_pos_x = game.zebra_width * self.zoom + self.cam_pos_X
+        traffic_light_pos_y = self.cam_pos_Y
+        traffic_light_w = game.zebra_width / 3 * self.zoom
+        traffic_light_h = -game.zebra_width * self.zoom
+        rect = pygame.draw.rect(self.screen, self.violet,
+                                [traffic_light_pos_x, traffic_light_pos_y, traffic_light_w, traffic_light_h], 3)
+        lamps = ((self.red, 5 / 6, red_light), (self.yellow, 3 / 6, yellow_light), (self.green, 1 / 6, green_light))
+        for color, height, light in lamps:
+            rect = rect.union(pygame.draw.circle(self.screen, color,
+                                                 [int(traffic_light_pos_x + 1 / 2 * traffic_light_w),
+                                                  int(traffic_light_pos_y + height * traffic_light_h)],
+                                                 int(traffic_light_w / 2), not light))
+        return rect
+
+    def draw_lamp(self, position, text, color, val):
+        rect = self.draw_text(text, (position[0] + 10, position[1]))
+
+        rect = rect.union(pygame.draw.circle(self.screen, (128, 128, 128), (position[0], position[1] + 7), 5, 1))
+
+        if val:
+            pygame.draw.circle(self.screen, color, (position[0], position[1] + 7), 4, 0)
+        return rect
+
+    def draw_bar(self, rect, color, val):
+        frame = pygame.draw.rect(self.screen, (128, 128, 128),
+                                 ((rect[0][0], rect[0][1]), (rect[1][0], rect[1][1])), 1)
+        if val:
+            pygame.draw.rect(self.screen, color,
+                             ((rect[0][0] + 1, rect[0][1] + rect[1][1] - 2), (rect[1][0] - 2, -val * (rect[1][1] - 4))))
+        return frame
+
+    def draw_text(self, text, position):
+        surface = self.texts.get(text)
+        if surface is None:
+            if len(self.texts) > 256:
+                self.texts.clear()
+            surface = self.texts[text] = self.font.render(text, True, self.white)
+        return self.screen.blit(surface, position)
+
+    def draw_sensors(self, surface):
+        game = self.game
+        for s in game.sensors:
+            pygame.draw.line(surface, self.white,
+                             [self.cam_pos_X + (game.zebra_width + s) * self.zoom, self.cam_pos_Y], [
+                                 self.cam_pos_X + (game.zebra_width + s) * self.zoom,
+                                 self.cam_pos_Y + (game.road_width / 2) * self.zoom])
+            pygame.draw.line(surface, self.white,
+                             [self.cam_pos_X - s * self.zoom, self.cam_pos_Y + game.road_width * self.zoom],
+                             [self.cam_pos_X - s * self.zoom, self.cam_pos_Y + game.road_width / 2 * self.zoom])
+
+    def draw(self):
+        game = self.game
+        full = self.background is None or self.background_sensors != tuple(game.sensors)
+        if full:
+            self.background = pygame.Surface(self.size)
+            self.background.fill(self.black)
+            self.draw_zebra(self.background)
+            self.draw_sensors(self.background)
+            self.background_sensors = tuple(game.sensors)
+            self.screen.blit(self.background, (0, 0))
+        else:
+            for rect in self.dirty:
+                self.screen.blit(self.background, rect, rect)
+
+        rects = [self.draw_traffic_light()]
+        for car in game.cars:
+            rects.append(pygame.draw.rect(self.screen, self.red,
+                                          [car.pos[0] * self.zoom + self.cam_pos_X,
+                                           car.pos[1] * self.zoom + self.cam_pos_Y,
+                                           car.w * self.zoom, car.h * self.zoom], 2))
+
+        for p in game.pedestrians:
+            rects.append(pygame.draw.rect(self.screen, self.pink,
+                                          [p.pos[0] * self.zoom + self.cam_pos_X, p.pos[1] * self.zoom + self.cam_pos_Y,
+                                           p.l * self.zoom, p.l * self.zoom]))
+
+        rects.append(self.draw_bar(((50, 10), (10, 50)), (40, 235, 40), game.inputs[0]))
+
+        rects.append(self.draw_bar(((100, 10), (10, 50)), (235, 40, 40), game.outputs[0]))
+        rects.append(self.draw_bar(((115, 10), (10, 50)), (40, 40, 235), game.outputs[1]))
+        rects.append(self.draw_bar(((130, 10), (10, 50)), (40, 40, 235), game.outputs[2]))
+        for i in range(3, len(game.outputs)):
+            rects.append(self.draw_bar(((100 + i * 15, 10), (10, 50)), self.white, game.outputs[i]))
+
+        if game.sim_time:
+            rects.append(self.draw_bar(((500, 10), (10, 50)), (235, 40, 40), game.red_time / game.sim_time))
+            rects.append(self.draw_bar(((515, 10), (10, 50)), (40, 235, 40), game.green_time / game.sim_time))
+            rects.append(self.draw_bar(((530, 10), (10, 50)), (235, 235, 40), game.switch_time / game.sim_time))
+
+        rects.append(self.draw_text("Simulation time:  {:.0f}s".format(game.sim_time), (650, 10)))
+        rects.append(self.draw_text("Cars crossed:  {}".format(game.cars_crossed), (650, 30)))
+        rects.append(self.draw_text("Peds crossed: {}".format(game.peds_crossed), (650, 50)))
+        if game.cars_crossed:
+            rects.append(self.draw_text("Cars wait:  {:3.1f}s".format(game.cars_wait / game.cars_crossed), (650, 70)))
+        if game.peds_crossed:
+            rects.append(self.draw_text("Peds wait: {:3.1f}s".format(game.peds_wait / game.peds_crossed), (650, 90)))
+
+        rects.append(self.draw_text("Fitness: {:6.0f}".format(game.fitness), (650, 110)))
+
+        if full:
+            pygame.display.flip()
+        else:
+            pygame.display.update(self.dirty + rects)
+        self.dirty = rects
+
+    def dispatch_messages(self):
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                self.game.closed = True
+            if event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_RETURN:
+                    self.game.restart()
@@ -0,0 +1,89 @@
+import struct
+import time
+
+__author__ = "leon.ljsh"
+
+# Game.get reports 13 values that are all 0 or 1, packed they are one field per environment. The action fits one
+# byte, but only where both ends agree on it, nlab sessions negotiate the input count alone
+OBSERVATION_BITS = 13
+PLAIN_INCOUNT = OBSERVATION_BITS
+PACKED_INCOUNT = 1
+OUTCOUNT = 1
+
+UNPACKED = [tuple((mask >> i) & 1 for i in range(OBSERVATION_BITS)) for mask in range(1 << OBSERVATION_BITS)]
+# bit i holds outputs[i], a lookup by tuple is cheaper than shifting the bits in one by one
+PACKED = {bits: mask for mask, bits in enumerate(UNPACKED)}
+
+
+def pack_observation(outputs):
+    return PACKED[tuple(outputs)]
+
+
+def unpack_observation(mask):
+    return list(UNPACKED[mask])
+
+
+def pack_action(inputs):
+    return min(255, max(0, round(inputs[0] * 255)))
+
+
+def unpack_action(value):
+    return [value / 255]
+
+
+def pack_observations(observations):
+    return struct.pack("<{}H".format(len(observations)), *map(PACKED.__getitem__, map(tuple, observations)))
+
+
+def unpack_observations(data):
+    return [list(UNPACKED[mask]) for mask in struct.unpack("<{}H".format(len(data) // 2), data)]
+
+
+def pack_actions(actions):
+    return bytes(pack_action(a) for a in actions)
+
+
+def unpack_actions(data):
+    return [[value / 255] for value in data]
+
+
+def per_call(function, argument, duration=0.3):
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        function(argument)
+        count += 1
+    return (time.perf_counter() - start) / count
+
+
+def main():
+    import random
+
+    from common import rule
+
+    generator = random.Random(0)
+    print("{:>8} {:>14} {:>14} {:>14} {:>14} {:>12} {:>12}".format(
+        "count", "plain enc us", "plain dec us", "packed enc us", "packed dec us", "plain bytes", "packed bytes"))
+    for count in (1, 16, 256):
+        observations = [[generator.getrandbits(1) for _ in range(OBSERVATION_BITS)] for _ in range(count)]
+        actions = [rule(o) for o in observations]
+        # the plain format as 13 doubles per observation and one per action
+        plain_format = "<{}d".format(count * OBSERVATION_BITS)
+
+        def pack_plain(batch):
+            return struct.pack(plain_format, *[value for o in batch for value in o])
+
+        plain = pack_plain(observations)
+        packed = pack_observations(observations)
+        assert unpack_observations(packed) == observations
+        assert [a[0] > 0.5 for a in unpack_actions(pack_actions(actions))] == [a[0] > 0.5 for a in actions]
+
+        print("{:8} {:14.2f} {:14.2f} {:14.2f} {:14.2f} {:12} {:12}".format(
+            count, per_call(pack_plain, observations) * 1e6,
+            per_call(lambda data: struct.unpack(plain_format, data), plain) * 1e6,
+            per_call(pack_observations, observations) * 1e6, per_call(unpack_observations, packed) * 1e6,
+            len(plain) + 8 * count, len(packed) + len(pack_actions(actions))))
+
+
+if __name__ == "__main__":
+    main()